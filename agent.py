@@ -5,11 +5,19 @@ import numpy as np
 
 import sokobanbot
 from sokobanbot import Sokoban
+from sokobanvec import VectorSokoban
 from collections import deque
-from model import QTrainer, Linear_QNet
+from model import QTrainer, Linear_QNet, ConvQNet
+from replay import ReplayBuffer, PrioritizedReplayBuffer
+from checkpoint import Checkpointer
+from metrics import MetricsLogger
+from cache import StateCache
+from acting import ActingModel
+from trajectory import TrajectoryRecorder, TrajectoryDataset
+import profiling
+import solver
 import pickle
 import os
-import matplotlib.pyplot as plt
 import sokobanbot
 
 MAX_MEMORY = 100_000
@@ -19,25 +27,106 @@ LR = 0.001  # learning rate
 games_to_train = 10_000
 avg_track = 75
 
+def masked_choice(q, masks, explore):
+    # Greedy move over the legal ones of every row of q, a uniformly random legal one where explore is set
+    masks = masks | ~masks.any(axis=1, keepdims=True)  # boxed in players fall back to every move
+    scores = np.where(explore[:, None], np.random.random(q.shape), q)
+    return np.where(masks, scores, -np.inf).argmax(axis=1)
+
+
 class Agent:
 
-    def __init__(self, width = 9, height = 9, blocks = 1, render = True, debug_mode = False):
+    # model_type 'conv' uses grid planes (Sokoban.grid_state) and a ConvQNet that plays any board up to
+    # board_size x board_size with any number of blocks, 'linear' uses the feature list below and a Linear_QNet
+    def __init__(self, width = 9, height = 9, blocks = 1, render = True, debug_mode = False, prioritized = False,
+                 target_sync = None, tau = None, double_dqn = False, train_every = None,
+                 model_type = 'linear', board_size = None, cache_size = None, mask_actions = False,
+                 macro_actions = False, acting = None, acting_refresh = 1000, acting_threads = None):
 
         self.games_completed = 0
         self.games_played = 0
         self.epsilon = 1.0  # randomness
         self.epsilon_min = 0.05
         self.epsilon_decay = 0.999995
-        temp_game = Sokoban(width, height, blocks, render, debug_mode)
+        # Side of the grid planes for the conv model, None for the feature list
+        self.board_size = (board_size or max(width, height)) if model_type == 'conv' else None
+        # Only used to size the model, never drawn
+        temp_game = Sokoban(width, height, blocks, False, debug_mode)
         # Size to be passed into model
-        input_size = temp_game.num_objects * 5 + 6
+        state_shape = self.get_state(temp_game).shape
+        # grid planes are 0/1, stored as bytes in the memory
+        state_dtype = torch.uint8 if self.board_size else torch.float
+        # macro_actions: one action per (block, direction) push, played with Sokoban.push_step, instead of single moves
+        self.macro_actions = macro_actions
+        self.num_actions = 4 * blocks if macro_actions else 4
         self.gamma = 0.9  # cares about long term reward (very cool)
-        self.memory = deque(maxlen=MAX_MEMORY)  # popleft when memory is reached
         # Uses CUDA for training (if having eligible gpu)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # overwrites oldest when memory is reached, prioritized samples by TD error instead of uniformly
+        self.prioritized = prioritized
+        if prioritized:
+            self.memory = PrioritizedReplayBuffer(MAX_MEMORY, state_shape, self.device, state_dtype, self.num_actions)
+        else:
+            self.memory = ReplayBuffer(MAX_MEMORY, state_shape, self.device, state_dtype, self.num_actions)
         # Init model, .to(self.device) moves the data from RAM to VRAM so the gpu can train it
-        self.model = Linear_QNet(input_size, 512, 4).to(self.device)
-        self.trainer = QTrainer(self.model, LR, self.gamma)
+        if self.board_size:
+            self.model = ConvQNet(self.board_size, output_size=self.num_actions).to(self.device)
+        else:
+            self.model = Linear_QNet(state_shape[0], 512, self.num_actions).to(self.device)
+        self.trainer = QTrainer(self.model, LR, self.gamma, target_sync, tau, double_dqn)
+        # None = train on every transition as it happens, K = train on a replay batch every K transitions
+        self.train_every = train_every
+        self.steps_since_update = 0
+        # LRU cache of legal moves and greedy Q-values for boards seen before (cache_size entries), None = off
+        self.cache = StateCache(cache_size) if cache_size else None
+        # Only pick moves that change the board (exploring, exploiting and in the target max), no wasted no-op steps
+        self.mask_actions = mask_actions
+        # Pick moves with an inference only copy of the model ('eager', 'script' or 'int8', see acting.ActingModel)
+        # refreshed every acting_refresh updates, None = act with the learner itself
+        # acting_threads only applies to its forward passes, the learner keeps the process thread count
+        self.acting = ActingModel(self.model, acting, acting_refresh, threads = acting_threads) if acting else None
+
+    def recorder(self, directory, **options):
+        # trajectory.TrajectoryRecorder storing states and actions the way this agent's memory does
+        return TrajectoryRecorder(directory, self.memory.states.shape[1:], self.memory.states.numpy().dtype,
+                                  self.num_actions, **options)
+
+    def state_dict(self):
+        # Everything needed to resume training except the replay memory, same keys as agent_checkpoint.pth
+        state = {
+            'model_state': self.model.state_dict(),
+            'optimizer_state': self.trainer.optimizer.state_dict(),
+            'epsilon': self.epsilon,
+            'number_of_games': self.games_completed,
+            'games_played': self.games_played,
+            'max_memory': MAX_MEMORY,
+            'updates': self.trainer.updates,
+            'steps_since_update': self.steps_since_update,
+            'rng_state': (random.getstate(), np.random.get_state(), torch.get_rng_state()),
+        }
+        if self.trainer.target_model is not None:
+            state['target_state'] = self.trainer.target_model.state_dict()
+        return state
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model_state'])
+        self.trainer.optimizer.load_state_dict(state['optimizer_state'])
+        self.epsilon = state['epsilon']
+        self.games_completed = state['number_of_games']
+        self.games_played = state.get('games_played', 0)
+        self.trainer.updates = state.get('updates', 0)
+        self.steps_since_update = state.get('steps_since_update', 0)
+        if self.trainer.target_model is not None:
+            self.trainer.target_model.load_state_dict(state.get('target_state', state['model_state']))
+        if self.cache:
+            self.cache.clear()
+        if self.acting:
+            self.acting.refresh(self.model, self.trainer.updates)
+        if 'rng_state' in state:
+            py_state, np_state, torch_state = state['rng_state']
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+            torch.set_rng_state(torch_state)
 
     def get_state(self, game):
         # State array is as follows:
@@ -61,112 +150,274 @@ class Agent:
             VERTICAL, HORIZONTAL
 
         """
-        # len = 4
-        state = [
-            game.can_move_up(),
-            game.can_move_down(),
-            game.can_move_left(),
-            game.can_move_right()
-        ]
-
-        # len = 2
-        state.extend(game.player_state())
-        # len = num_objects * 2
-        state.extend(game.block_state())
-        # len = num_objects * 2
-        state.extend(game.hole_state())
-
-        return np.array(state, dtype=int)  # convert bools and floats to np array,
-
-    def remember(self, state, action, reward, next_state, game_over):
-        self.memory.append((state, action, reward, next_state, game_over))  # pop left if MAX_MEMORY is reached
+        if self.board_size:
+            return game.grid_state(self.board_size)
+
+        return game.feature_state()
+
+    def get_states(self, env):
+        # Batched get_state for a VectorSokoban
+        if self.board_size:
+            return env.get_grid_state(self.board_size)
+        return env.get_state()
+
+    def remember(self, state, action, reward, next_state, game_over, next_mask = None):
+        # action is the one-hot move list, stored as its index, next_mask the legal moves in next_state
+        self.memory.push(state, np.argmax(action), reward, next_state, game_over, next_mask)  # overwrites oldest if MAX_MEMORY is reached
+
+    def remember_batch(self, states, actions, rewards, next_states, game_overs, next_masks = None):
+        # actions are move indices, one row per transition
+        self.memory.push_batch(states, actions, rewards, next_states, game_overs, next_masks)
 
     # Trains AI on other random games too
     def train_long_memory(self):
-        if len(self.memory) > BATCH_SIZE:
-            mini_sample = random.sample(self.memory, BATCH_SIZE)  # returns list of tuples
+        if len(self.memory) == 0:
+            return
+        if self.prioritized:
+            states, actions, rewards, next_states, dones, next_masks, weights, idx = self.memory.sample(BATCH_SIZE)
+            td_errors = self.trainer.train_batch(states, actions, rewards, next_states, dones, weights,
+                                                 next_masks if self.mask_actions else None)
+            self.memory.update_priorities(idx, td_errors.cpu().numpy())
         else:
-            mini_sample = self.memory
-
-        states, actions, rewards, next_states, dones = zip(*mini_sample)
-        self.trainer.train_step(states, actions, rewards, next_states, dones)
+            states, actions, rewards, next_states, dones, next_masks = self.memory.sample(BATCH_SIZE)
+            self.trainer.train_batch(states, actions, rewards, next_states, dones,
+                                     next_mask=next_masks if self.mask_actions else None)
 
     # Trains AI on game that just finished
-    def train_short_memory(self, state, action, reward, next_state, game_over):
-        self.trainer.train_step(state, action, reward, next_state, game_over)
-
-    def get_action(self, state):
+    def train_short_memory(self, state, action, reward, next_state, game_over, next_mask = None):
+        self.trainer.train_step(state, action, reward, next_state, game_over, next_mask)
+
+    # Called after every environment step (num_steps > 1 for a batch of transitions)
+    def learn(self, state, action, reward, next_state, game_over, num_steps = 1, next_mask = None):
+        if not self.train_every:
+            self.train_short_memory(state, action, reward, next_state, game_over, next_mask)
+            return
+
+        self.steps_since_update += num_steps
+        while self.steps_since_update >= self.train_every:
+            self.steps_since_update -= self.train_every
+            self.train_long_memory()
+
+    # Plays a solver solution on game from its current board, storing every transition in memory
+    def remember_demonstration(self, game, actions):
+        if self.macro_actions:
+            actions = self._solution_pushes(game, actions)
+        for move in actions:
+            final_move = [0] * self.num_actions
+            final_move[move] = 1
+            state_old = self.get_state(game)
+            reward, game_over, game_win, _ = self.play(game, final_move)
+            state_new = self.get_state(game)
+            next_mask = self.legal_mask(game, state_new) if self.mask_actions else None
+            self.remember(state_old, final_move, reward, state_new, game_over, next_mask)
+            if game_over:
+                return game_win
+        return False
+
+    def q_values(self, state):
+        # Q-values of one state as a numpy array, cached per weight version (QTrainer.updates) if the cache is on
+        # with an acting copy the version is the update it was refreshed at, so the cache holds until the next refresh
+        version = self.trainer.updates
+        if self.acting:
+            self.acting.sync(self.model, version)
+            version = self.acting.version
+        if self.cache:
+            return self.cache.q_values(state, version, self._q_values)
+        return self._q_values(state)
+
+    def _q_values(self, state):
+        if self.acting:
+            return self.acting(state)
+        state0 = torch.tensor(state, dtype=torch.float).unsqueeze(0).to(self.device)
+        with torch.no_grad():
+            return self.model(state0)[0].cpu().numpy()
+
+    def legal_mask(self, game, state):
+        # bool array of the legal actions on game's board (moves, or pushes with macro_actions), state is game's
+        # encoded state (the cache key)
+        if self.cache:
+            return self.cache.legal_mask(state, game, self.macro_actions)
+        return game.legal_moves(self.macro_actions)
+
+    def play(self, game, action):
+        # Plays a one-hot action on game, returns (reward, game_over, win, single moves made)
+        if self.macro_actions:
+            return game.push_step(np.argmax(action))
+        return game.play_step(action) + (1,)
+
+    @staticmethod
+    def _solution_pushes(game, actions):
+        # Push actions (block * 4 + direction) of a move by move solution, the walks in between are left to push_step
+        blocks = game.block_grid.copy()
+        x, y = game.player
+        pushes = []
+        for move in actions:
+            dx, dy = sokobanbot.DELTAS[sokobanbot.ACTIONS[move]]
+            x, y = x + dx, y + dy
+            block = blocks[y, x]
+            if block != sokobanbot.NO_BLOCK:
+                pushes.append(int(block) * 4 + move)
+                blocks[y, x] = sokobanbot.NO_BLOCK
+                blocks[y + dy, x + dx] = block
+        return pushes
+
+    def get_action(self, state, mask = None):
         """
         Decide which action to take given the current state.
 
         Uses epsilon-greedy strategy:
         - With probability epsilon: choose a random action (exploration)
         - Otherwise: choose the action with the highest predicted Q-value (exploitation)
+
+        mask is an optional (4,) bool of the legal moves, both choices are then limited to those.
         """
 
         # Update epsilon (exploration rate)
         # As the number of games increases, epsilon decreases
         self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
 
-        # Array denoting the move to be made, udlr
-        final_move = [0, 0, 0, 0]
+        # Array denoting the move to be made, udlr (or the push, with macro actions)
+        final_move = [0] * self.num_actions
 
         # Decide whether to explore or exploit
+        if mask is not None and not mask.any():
+            mask = None
         if random.random() < self.epsilon:
-            move = random.randint(0, 3)
+            move = random.randint(0, self.num_actions - 1) if mask is None else random.choice(np.flatnonzero(mask).tolist())
         else:
-            # Convert state to a PyTorch tensor
-            state0 = torch.tensor(state, dtype=torch.float).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                prediction = self.model(state0)
-            move = torch.argmax(prediction, dim=1).item()
+            q = self.q_values(state)
+            move = int(np.argmax(q if mask is None else np.where(mask, q, -np.inf)))
 
         final_move[move] = 1
         return final_move
 
+    def get_actions(self, states, masks = None):
+        """
+        Batched get_action for an (N, state size) array of states, returns (N,) action indices.
 
-def train(w = 9, h = 9, num_objects = 1, render = True, debug_mode = False):
-    rewards = []
-    record = 10_000_000
-    agent = Agent(w, h, num_objects, render, debug_mode)
-
-    plt.ion()
+        Epsilon is decayed once per state, same schedule as calling get_action N times.
+        masks is an optional (N, 4) bool of the legal moves of every board.
+        """
+        n = len(states)
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay ** n)
 
-    game = Sokoban(w, h, num_objects, render, debug_mode)
+        # One forward pass for the whole batch
+        if self.acting:
+            self.acting.sync(self.model, self.trainer.updates)
+            q = self.acting.batch(states)
+        else:
+            states0 = torch.tensor(states, dtype=torch.float).to(self.device)
+            with torch.no_grad():
+                q = self.model(states0).cpu().numpy()
+        explore = np.random.random(n) < self.epsilon
+
+        if masks is None:
+            moves = q.argmax(axis=1)
+            moves[explore] = np.random.randint(0, self.num_actions, explore.sum())
+            return moves
+        return masked_choice(q, masks, explore)
+
+
+# demonstrations: number of solver solved games to seed the memory with before training
+# compare_optimal: solve every board so wins can be compared against the optimal number of moves
+# level_pool: path to a levelgen pool or levelset collection file to draw levels from instead of placing them randomly
+# checkpoint_every: write a full training checkpoint to checkpoint_dir every N finished games (None = never)
+# save_memory: include the replay memory in checkpoints, resume: carry on from the newest checkpoint in checkpoint_dir
+# profile: time every phase of a step and print a breakdown every profile_every steps (or set SOKOBAN_PROFILE=1)
+# profile_capture: (kind, start, steps) to run cProfile (kind 'cprofile') or torch.profiler ('torch') over a window of steps
+# record_dir: stream every transition to a trajectory recording there (read it back with trajectory.TrajectoryDataset)
+# warm_start: recording directory to fill the replay memory from before training
+# agent_options are passed on to Agent (prioritized, target_sync, tau, double_dqn, train_every, acting)
+def train(w = 9, h = 9, num_objects = 1, render = True, debug_mode = False, demonstrations = 0,
+          compare_optimal = False, level_pool = None, checkpoint_dir = './checkpoints', checkpoint_every = None,
+          save_memory = False, resume = False, metrics_path = './metrics/train.csv',
+          profile = False, profile_every = 10_000, profile_capture = None, record_dir = None, warm_start = None,
+          **agent_options):
+    record = 10_000_000
+    agent = Agent(w, h, num_objects, render, debug_mode, **agent_options)
+    recorder = agent.recorder(record_dir) if record_dir else None
+    if warm_start:
+        print(f'Warm started memory with {TrajectoryDataset(warm_start).fill(agent.memory)} transitions')
+    # Writes checkpoints and record models off the training thread
+    checkpointer = Checkpointer(checkpoint_dir)
+    if checkpoint_every and not resume and checkpointer.has_checkpoints():
+        # A fresh run's checkpoints would be mixed up with (and pruned against) the old run's
+        raise ValueError(f'{checkpoint_dir} already holds checkpoints, pass resume=True to carry on from them '
+                         f'or use another checkpoint_dir')
+    # One row per finished game, plot it with `python metrics.py plot <metrics_path>`, a resumed run adds to it
+    metrics = MetricsLogger(metrics_path, append = resume)
+    if profile:
+        profiling.enable()
+    if profile_capture:
+        profiling.capture(*profile_capture[1:], kind=profile_capture[0])
+
+    game = Sokoban(w, h, num_objects, render, debug_mode, level_pool)
+
+    if demonstrations:
+        seeded = 0
+        for _ in range(demonstrations):
+            game.reset()
+            result = solver.solve(game)
+            if result.solved:
+                agent.remember_demonstration(game, result.actions)
+                seeded += 1
+        print(f'Seeded memory with {seeded} solved games')
+        game.reset()
+
+    optimal = solver.solve(game).moves if compare_optimal else None
     total_reward = 0
     cur_moves = 0
 
     global avg_track
     global games_to_train
-    # For each game that gets complete, stores avg moves last for last {avg_track} games
-    # When training is finished len(avg_moves) == games_to_train
-    avg_moves = []
     # Total moves made last {avg_track} games
     moves_last_track = 0
-    # List of moves in last {avg_track} games
-    moves_made = []
-
-
+    # Moves in last {avg_track} won games
+    moves_made = deque(maxlen=avg_track)
+    # Environment steps since the last finished game, for steps/sec
+    steps = 0
+    last_time = time.perf_counter()
+
+    if resume:
+        state = checkpointer.load_latest(agent.memory if save_memory else None, agent.device)
+        if state is not None:
+            agent.load_state_dict(state)
+            record = state['record']
+            moves_made.extend(state['moves_made'])
+            moves_last_track = sum(moves_made)
+            print(f'Resumed from game {agent.games_completed}')
 
     while agent.games_completed < games_to_train:
         # get old state
-        state_old = agent.get_state(game)
+        with profiling.span('get_state'):
+            state_old = agent.get_state(game)
 
         # get move
-        get_move = agent.get_action(state_old)
+        with profiling.span('get_action'):
+            mask = agent.legal_mask(game, state_old) if agent.mask_actions else None
+            get_move = agent.get_action(state_old, mask)
 
-        # perform move and get state
-        reward, game_over, game_win = game.play_step(get_move)
-        state_new = agent.get_state(game)
-
-        # train short mem
-        agent.train_short_memory(state_old, get_move, reward, state_new, game_over)
+        # perform move (walk and push with macro actions) and get state
+        with profiling.span('play_step'):
+            reward, game_over, game_win, moves = agent.play(game, get_move)
+        with profiling.span('get_state'):
+            state_new = agent.get_state(game)
+            next_mask = agent.legal_mask(game, state_new) if agent.mask_actions else None
 
         # remember
-        agent.remember(state_old, get_move, reward, state_new, game_over)
+        with profiling.span('remember'):
+            agent.remember(state_old, get_move, reward, state_new, game_over, next_mask)
+            if recorder:
+                recorder.add(state_old, np.argmax(get_move), reward, state_new, game_over, next_mask)
+
+        # train short mem (or a replay batch every train_every steps)
+        with profiling.span('train_short_memory'):
+            agent.learn(state_old, get_move, reward, state_new, game_over, next_mask = next_mask)
         total_reward += reward
+        profiling.step(profile_every)
 
-        cur_moves += 1
+        cur_moves += moves
+        steps += 1
 
         if game_over:
             agent.games_played += 1
@@ -176,47 +427,258 @@ def train(w = 9, h = 9, num_objects = 1, render = True, debug_mode = False):
                 # Increments number of games won
                 agent.games_completed += 1
 
-                # Adds cur_moves made to moves_made list
+                # If there are already {avg_track} moves made, subtract the moves from {avg_track}th game ago
+                if len(moves_made) == avg_track:
+                    moves_last_track -= moves_made[0]
+                # Adds cur_moves made to moves_made (drops the oldest) and to the sum of moves made last {avg_track} games
                 moves_made.append(cur_moves)
-                # Add cur_moves to sum of moves made last 100 games
                 moves_last_track += cur_moves
-                # If there is more than {avg_track} moves made
-                if len(moves_made) > avg_track:
-                    # subtract the moves from {avg_track}th game ago
-                    moves_last_track -= moves_made[0]
-                    # Removes from list
-                    moves_made.pop(0)
-                # calculate average moves
-                avg_moves.append(moves_last_track / len(moves_made))
                 # keeps track of record
                 if record > cur_moves:
                     record = cur_moves
                     # Saves this model, as it is 'seemingly' the best (could just be lucky scramble)
-                    agent.model.save()
+                    checkpointer.save_model(agent.model)
 
-                print(f'Games: {agent.games_completed}, Record: {record}')
+                if compare_optimal:
+                    print(f'Games: {agent.games_completed}, Record: {record}, Moves: {cur_moves}, Optimal: {optimal}')
+                else:
+                    print(f'Games: {agent.games_completed}, Record: {record}')
 
             # train long term mem
             game.reset()
+            if compare_optimal:
+                optimal = solver.solve(game).moves
+            with profiling.span('train_long_memory'):
+                for _ in range(4):  # train 4x per episode
+                    agent.train_long_memory()
+
+            now = time.perf_counter()
+            loss = agent.trainer.last_loss
+            metrics.log(games = agent.games_completed, games_played = agent.games_played, win = int(game_win),
+                        moves = cur_moves, avg_moves = moves_last_track / len(moves_made) if moves_made else '',
+                        reward = round(total_reward, 2), epsilon = agent.epsilon,
+                        loss = loss.item() if loss is not None else '', steps_per_sec = round(steps / (now - last_time), 1),
+                        memory = len(agent.memory), **(agent.cache.stats() if agent.cache else {}))
+            steps = 0
+            last_time = now
+            total_reward = 0
+            cur_moves = 0
+
+            if agent.games_played % 1000 == 0:
+                print(f'Games: {agent.games_completed}, Record: {record}')
+
+            if checkpoint_every and agent.games_played % checkpoint_every == 0:
+                state = agent.state_dict()
+                state.update(record=record, moves_made=list(moves_made))
+                checkpointer.save(agent.games_played, state, agent.memory if save_memory else None)
+
+    if recorder:
+        recorder.close()
+    checkpointer.wait()
+    metrics.close()
+
+
+
+
+# tiers: curriculum.Tier stages from easiest to hardest, the Curriculum options (window, promote_rate, max_avg_moves,
+# mix) are passed as curriculum_options. The conv model is used by default so one network plays every tier
+def train_curriculum(tiers = None, curriculum_options = None, metrics_path = './metrics/curriculum.csv',
+                     checkpoint_dir = './checkpoints', **agent_options):
+    from curriculum import Curriculum, DEFAULT_TIERS
+
+    curriculum = Curriculum(tiers or DEFAULT_TIERS, **(curriculum_options or {}))
+    w, h, num_objects = curriculum.board_bounds()
+    agent_options.setdefault('model_type', 'conv')
+    if len({t.num_objects for t in curriculum.tiers}) > 1 and (
+            agent_options['model_type'] != 'conv' or agent_options.get('macro_actions')):
+        raise ValueError('Tiers with different block counts need the conv model and single moves')
+    agent = Agent(w, h, num_objects, False, **agent_options)
+    checkpointer = Checkpointer(checkpoint_dir)
+    metrics = MetricsLogger(metrics_path)
+    record = {}
+
+    tier, game = curriculum.next_game()
+    cur_moves = 0
+    total_reward = 0
+    while agent.games_completed < games_to_train:
+        state_old = agent.get_state(game)
+        mask = agent.legal_mask(game, state_old) if agent.mask_actions else None
+        get_move = agent.get_action(state_old, mask)
+        reward, game_over, game_win, moves = agent.play(game, get_move)
+        state_new = agent.get_state(game)
+        next_mask = agent.legal_mask(game, state_new) if agent.mask_actions else None
+
+        agent.remember(state_old, get_move, reward, state_new, game_over, next_mask)
+        agent.learn(state_old, get_move, reward, state_new, game_over, next_mask = next_mask)
+        total_reward += reward
+        cur_moves += moves
+
+        if game_over:
+            agent.games_played += 1
+            if game_win:
+                agent.games_completed += 1
+                # Records are kept per tier, the model is saved on a new record of the hardest tier reached
+                if cur_moves < record.get(tier, float('inf')):
+                    record[tier] = cur_moves
+                    if tier == curriculum.current:
+                        checkpointer.save_model(agent.model)
+
+            if curriculum.record(tier, game_win, cur_moves):
+                t = curriculum.tiers[curriculum.current]
+                print(f'Games: {agent.games_completed}, promoted to tier {curriculum.current}: '
+                      f'{t.w}x{t.h}, {t.num_objects} blocks, pushes {t.pushes}')
+
+            metrics.log(games = agent.games_completed, games_played = agent.games_played, tier = tier,
+                        current_tier = curriculum.current, win = int(game_win), moves = cur_moves,
+                        solve_rate = curriculum.solve_rate(tier), reward = round(total_reward, 2),
+                        epsilon = agent.epsilon, memory = len(agent.memory))
+
             for _ in range(4):  # train 4x per episode
                 agent.train_long_memory()
-
-            rewards.append(total_reward)
+            tier, game = curriculum.next_game()
             cur_moves = 0
+            total_reward = 0
 
-            # Display Graph
-            if agent.games_completed % 10 == 1 and agent.games_completed > 0:
-                plt.clf()  # clear previous plot
-                game_number = list(range(len(avg_moves)))
-                plt.plot(game_number, avg_moves)
-                plt.xlabel('Game Number')
-                plt.ylabel(f'Average moves last {avg_track} games')
-                plt.pause(0.1)  # updates the plot without blocking
+    checkpointer.wait()
+    metrics.close()
+    return curriculum
 
-            if agent.games_played % 1000 == 0:
-                print(f'Games: {agent.games_completed}, Record: {record}')
 
+def train_vec(w = 9, h = 9, num_objects = 1, num_envs = 32, level_pool = None, record_dir = None, **agent_options):
+    # Same as train, but steps num_envs headless boards at once with batched forward passes and updates
+    record = 10_000_000
+    agent = Agent(w, h, num_objects, False, **agent_options)
+    if agent.macro_actions:
+        raise ValueError('macro_actions is only supported by train, VectorSokoban plays single moves')
+    recorder = agent.recorder(record_dir) if record_dir else None
+    # Record models are written off the loop and atomically, same as train
+    checkpointer = Checkpointer()
+    env = VectorSokoban(num_envs, w, h, num_objects, level_pool)
+    one_hot = np.eye(4, dtype=int)
+
+    # Moves made so far in the game on each board
+    cur_moves = np.zeros(num_envs, dtype=int)
+    # Moves made in the last {avg_track} won games
+    moves_made = deque(maxlen=avg_track)
+
+    states = agent.get_states(env)
+    masks = env.can_move() if agent.mask_actions else None
+    while agent.games_completed < games_to_train:
+        actions = agent.get_actions(states, masks)
+        final_moves = one_hot[actions]
+
+        # finished boards are reset inside play_step, their next state is never bootstrapped from (done = True)
+        rewards, dones, wins = env.play_step(actions)
+        next_states = agent.get_states(env)
+        next_masks = env.can_move() if agent.mask_actions else None
+        cur_moves += 1
+
+        agent.remember_batch(states, actions, rewards, next_states, dones, next_masks)
+        if recorder:
+            recorder.add_batch(states, actions, rewards, next_states, dones, next_masks)
+
+        # train short mem on the whole batch
+        agent.learn(states, final_moves, rewards, next_states, dones, num_envs, next_masks)
 
+        for i in np.nonzero(dones)[0]:
+            agent.games_played += 1
+            if wins[i]:
+                agent.games_completed += 1
+                moves_made.append(cur_moves[i])
+                if record > cur_moves[i]:
+                    record = cur_moves[i]
+                    checkpointer.save_model(agent.model)
+                print(f'Games: {agent.games_completed}, Record: {record}, Avg moves: {sum(moves_made) / len(moves_made):.1f}')
+
+            cur_moves[i] = 0
+            for _ in range(4):  # train 4x per episode
+                agent.train_long_memory()
+
+        states = next_states
+        masks = next_masks
+
+    if recorder:
+        recorder.close()
+    checkpointer.wait()
+
+
+# Trains a fresh agent on a trajectory recording only, no games are played. The agent has to be built like the
+# one that recorded it (w, h, num_objects, model_type, macro_actions) so states and actions line up
+def train_offline(directory, w = 9, h = 9, num_objects = 1, epochs = 1, batch_size = BATCH_SIZE, seed = None,
+                  metrics_path = './metrics/offline.csv', model_path = './model/model.pth', **agent_options):
+    agent = Agent(w, h, num_objects, False, **agent_options)
+    dataset = TrajectoryDataset(directory)
+    if dataset.state_shape != tuple(agent.memory.states.shape[1:]) or dataset.num_actions != agent.num_actions:
+        raise ValueError(f'Recording holds {dataset.state_shape} states with {dataset.num_actions} actions, '
+                         f'the agent uses {tuple(agent.memory.states.shape[1:])} with {agent.num_actions}')
+    if seed is not None:
+        torch.manual_seed(seed)
+    metrics = MetricsLogger(metrics_path)
+    checkpointer = Checkpointer()
+
+    updates = 0
+    for states, actions, rewards, next_states, dones, next_masks in dataset.batches(
+            batch_size, epochs, seed = seed, device = agent.device):
+        agent.trainer.train_batch(states, actions, rewards, next_states, dones,
+                                  next_mask = next_masks if agent.mask_actions else None)
+        updates += 1
+        if updates % 100 == 0:
+            metrics.log(updates = updates, samples = updates * batch_size, loss = agent.trainer.last_loss.item())
+
+    print(f'Trained {updates} batches on {len(dataset)} transitions x {epochs} epochs')
+    checkpointer.save_model(agent.model, model_path)
+    checkpointer.wait()
+    metrics.close()
+    return agent
+
+
+def train_parallel(w = 9, h = 9, num_objects = 1, num_workers = 4, envs_per_worker = 8, publish_every = 10,
+                   level_pool = None, **agent_options):
+    # Actor processes step the games, this process is the learner that owns the memory and the model
+    from rollout import RolloutPool
+
+    record = 10_000_000
+    agent = Agent(w, h, num_objects, False, **agent_options)
+    if agent.macro_actions:
+        raise ValueError('macro_actions is only supported by train, VectorSokoban plays single moves')
+    pool = RolloutPool(agent.model, w, h, num_objects, num_workers, envs_per_worker, agent.epsilon, level_pool,
+                       agent.board_size, agent.mask_actions)
+    one_hot = np.eye(4, dtype=int)
+    moves_made = deque(maxlen=avg_track)
+    updates = 0
+    # Record models are written off the learner loop and atomically, same as train
+    checkpointer = Checkpointer()
+
+    try:
+        while agent.games_completed < games_to_train:
+            for _, states, actions, rewards, next_states, dones, wins, cur_moves, next_masks in pool.collect():
+                final_moves = one_hot[actions]
+                agent.remember_batch(states, actions, rewards, next_states, dones, next_masks)
+                agent.learn(states, final_moves, rewards, next_states, dones, len(states), next_masks)
+
+                # Same per-transition epsilon schedule as get_action
+                agent.epsilon = max(agent.epsilon_min, agent.epsilon * agent.epsilon_decay ** len(states))
+
+                for i in np.nonzero(dones)[0]:
+                    agent.games_played += 1
+                    if wins[i]:
+                        agent.games_completed += 1
+                        moves_made.append(cur_moves[i])
+                        if record > cur_moves[i]:
+                            record = cur_moves[i]
+                            checkpointer.save_model(agent.model)
+                        print(f'Games: {agent.games_completed}, Record: {record}, Avg moves: {sum(moves_made) / len(moves_made):.1f}')
+
+                    for _ in range(4):  # train 4x per episode
+                        agent.train_long_memory()
+
+                updates += 1
+                if updates % publish_every == 0:
+                    pool.publish(agent.model)
+                    pool.set_epsilon(agent.epsilon)
+    finally:
+        pool.close()
+        checkpointer.wait()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,202 @@
+import json
+import os
+import platform
+import random
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from sokobanbot import Sokoban, ACTIONS
+
+
+def _seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def _timed(fn, repeats, seed):
+    # Runs fn (which returns the number of operations it did) repeats times, returns ops/sec of every run
+    # one untimed warm-up run first so imports, allocator and thread pool start-up aren't measured
+    _seed(seed)
+    fn()
+    rates = []
+    for r in range(repeats):
+        _seed(seed + r)
+        start = time.perf_counter()
+        ops = fn()
+        rates.append(ops / (time.perf_counter() - start))
+    return rates
+
+
+def bench_play_step(w, h, num_objects, steps, render=False):
+    # Random moves on one board, reset whenever a game ends
+    def run():
+        game = Sokoban(w, h, num_objects, render)
+        actions = np.random.randint(0, 4, steps)
+        for a in actions:
+            _, game_over, _ = game.play_step(ACTIONS[a])
+            if game_over:
+                game.reset()
+        return steps
+    return run
+
+
+def bench_get_state(w, h, num_objects, calls, board_size=None):
+    # Agent.get_state on random boards, the feature list or the grid planes of a conv agent
+    from agent import Agent
+
+    agent = Agent(w, h, num_objects, False, model_type='conv' if board_size else 'linear', board_size=board_size)
+    games = []
+    for _ in range(64):
+        game = Sokoban(w, h, num_objects)
+        games.append(game)
+
+    def run():
+        for i in range(calls):
+            agent.get_state(games[i % len(games)])
+        return calls
+    return run
+
+
+def bench_q_values(w, h, num_objects, calls, board_size=None, acting=None):
+    # Agent.q_values on one board (the acting forward pass), with the learner or an acting copy
+    from agent import Agent
+
+    agent = Agent(w, h, num_objects, False, model_type='conv' if board_size else 'linear', board_size=board_size,
+                  acting=acting)
+    state = agent.get_state(Sokoban(w, h, num_objects))
+
+    def run():
+        for _ in range(calls):
+            agent.q_values(state)
+        return calls
+    return run
+
+
+def bench_train_step(batch_size, updates, state_size=10, hidden_size=512, batched=True):
+    # QTrainer updates on random data, train_batch on ready tensors or train_step from lists (the train() path)
+    from model import Linear_QNet, QTrainer
+
+    model = Linear_QNet(state_size, hidden_size, 4)
+    trainer = QTrainer(model, 0.001, 0.9)
+    states = torch.rand(batch_size, state_size)
+    actions = torch.randint(0, 4, (batch_size,))
+    rewards = torch.rand(batch_size)
+    next_states = torch.rand(batch_size, state_size)
+    dones = torch.zeros(batch_size, dtype=torch.bool)
+    one_hot = np.eye(4, dtype=int)[actions.numpy()].tolist()
+
+    def run():
+        for _ in range(updates):
+            if batched:
+                trainer.train_batch(states, actions, rewards, next_states, dones)
+            else:
+                trainer.train_step(states.tolist(), one_hot, rewards.tolist(), next_states.tolist(), dones.tolist())
+        return updates * batch_size
+    return run
+
+
+def suite(quick=False):
+    # (name, unit, benchmark) for every case, quick shrinks the workloads for a fast sanity run
+    scale = 0.1 if quick else 1.0
+    n = lambda count: max(1, int(count * scale))
+
+    cases = []
+    for w, h, boxes in ((5, 5, 1), (9, 9, 1), (9, 9, 3), (12, 12, 4)):
+        cases.append((f'play_step/{w}x{h}/{boxes}box', 'steps/sec', bench_play_step(w, h, boxes, n(20_000))))
+    if os.path.exists('arial.ttf'):
+        cases.append(('play_step/9x9/1box/rendered', 'steps/sec', bench_play_step(9, 9, 1, n(2_000), render=True)))
+    for w, h, boxes in ((9, 9, 1), (9, 9, 3)):
+        cases.append((f'get_state/{w}x{h}/{boxes}box', 'calls/sec', bench_get_state(w, h, boxes, n(20_000))))
+    cases.append(('get_state/9x9/3box/grid', 'calls/sec', bench_get_state(9, 9, 3, n(20_000), board_size=9)))
+    for acting in (None, 'script', 'int8'):
+        cases.append((f'q_values/linear/{acting or "learner"}', 'calls/sec', bench_q_values(9, 9, 1, n(10_000), acting=acting)))
+        cases.append((f'q_values/conv/{acting or "learner"}', 'calls/sec',
+                      bench_q_values(9, 9, 3, n(2_000), board_size=9, acting=acting)))
+    for batch_size in (1, 64, 1024):
+        updates = n(max(20, 20_000 // batch_size))
+        cases.append((f'train_batch/{batch_size}', 'samples/sec', bench_train_step(batch_size, updates)))
+        cases.append((f'train_step/{batch_size}', 'samples/sec', bench_train_step(batch_size, updates, batched=False)))
+    return cases
+
+
+def run_suite(repeats=5, seed=0, quick=False, only=None, threads=None):
+    if threads:
+        torch.set_num_threads(threads)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'threads': torch.get_num_threads(),
+            'repeats': repeats,
+            'seed': seed,
+            'quick': quick,
+        },
+        'results': {},
+    }
+    for name, unit, fn in suite(quick):
+        if only and only not in name:
+            continue
+        rates = _timed(fn, repeats, seed)
+        results['results'][name] = {
+            'unit': unit,
+            'median': statistics.median(rates),
+            'mean': statistics.mean(rates),
+            'stdev': statistics.stdev(rates) if len(rates) > 1 else 0.0,
+            'min': min(rates),
+            'max': max(rates),
+        }
+        print(f'{name:<32} {statistics.median(rates):>12.1f} {unit}  (+/- {results["results"][name]["stdev"]:.1f})')
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    # Prints the median change of every case against a baseline, returns the cases slower by more than tolerance
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        change = result['median'] / old - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<32} {old:>12.1f} -> {result["median"]:>12.1f} {result["unit"]}  {100 * change:+6.1f}%{flag}')
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Throughput benchmarks for the game, state encoding and trainer')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='10x smaller workloads')
+    parser.add_argument('--only', default=None, help='run only cases whose name contains this')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--out', default=None, help='write results as JSON')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown counted as a regression')
+    args = parser.parse_args()
+
+    # rendered cases draw to an offscreen window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    results = run_suite(args.repeats, args.seed, args.quick, args.only, args.threads)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry once capacity is reached.
+
+    Counts hits and misses so the caller can tell whether the cache pays for itself.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        # Value for key (marked as most recently used), None if it isn't cached
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def state_key(state):
+    # Compact, exact key for a state array: its raw bytes (80 bytes for a 1 block feature list, int64)
+    return np.ascontiguousarray(state).tobytes()
+
+
+class StateCache:
+    """
+    Transposition cache for boards the agent has already seen, keyed by the encoded state.
+
+    Legal-move masks only depend on the board, so they are kept until evicted. Q-values depend on the
+    weights too: they are tagged with the weight version they were computed with (QTrainer.updates) and
+    the whole table is dropped as soon as a lookup comes with a newer version. During training that
+    version changes every update, so Q-values are only reused while the policy is fixed (greedy play,
+    evaluation, serving).
+
+    Legal masks depend on the walls, which the feature list leaves out, so their keys also hold the level's
+    walls (Sokoban.wall_key): boards that only differ in walls don't share a mask. Q-values are a function
+    of the state alone and are keyed on it.
+    """
+
+    def __init__(self, capacity=100_000):
+        self.masks = LRUCache(capacity)
+        self.q = LRUCache(capacity)
+        self.version = None
+
+    def legal_mask(self, state, game, pushes=False):
+        # bool array of the moves that change the board in action order, or of the possible pushes if pushes is set
+        key = state_key(state) + game.wall_key + (b'p' if pushes else b'')
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = game.legal_moves(pushes)
+            self.masks.put(key, mask)
+        return mask
+
+    def q_values(self, state, version, compute):
+        # Cached Q-values of state for weights at version, compute(state) fills a miss
+        if version != self.version:
+            self.q.clear()
+            self.version = version
+        key = state_key(state)
+        q = self.q.get(key)
+        if q is None:
+            q = compute(state)
+            self.q.put(key, q)
+        return q
+
+    def clear(self):
+        self.masks.clear()
+        self.q.clear()
+        self.version = None
+
+    def stats(self):
+        return {
+            'mask_hit_rate': self.masks.hit_rate(),
+            'q_hit_rate': self.q.hit_rate(),
+            'mask_entries': len(self.masks),
+            'q_entries': len(self.q),
+        }
@@ -0,0 +1,157 @@
+import copy
+import os
+import shutil
+import threading
+
+import torch
+
+from replay import ReplayBuffer
+
+# Written last, holds the name of the newest complete checkpoint
+LATEST = 'latest'
+
+
+def _fsync_dir(directory):
+    # Makes renames inside directory durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_save(obj, path):
+    # torch.save to a temp file then rename over path, a crash leaves either the old file or the new one
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path) or '.')
+
+
+def _atomic_write_text(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path) or '.')
+
+
+def _cpu_copy(obj):
+    # Detached CPU copy of a (nested) state_dict so training can keep updating the originals
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_copy(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+class Checkpointer:
+    """
+    Writes training checkpoints from a background thread.
+
+    save() snapshots the state on the calling thread (CPU copies of the tensors, plus the filled part of
+    the replay memory if given) and hands the writing to a worker, so the training loop only pays for the
+    copy. A checkpoint is ckpt_<n>.pth plus, optionally, a ckpt_<n>.memory directory of .npy files that
+    ReplayBuffer.load memory maps back in. Every file is written to a temp name and renamed, and the
+    `latest` pointer is only updated once both are complete, so a crash mid-write never loses the last
+    good checkpoint. Only the `keep` most recently written checkpoints are kept, and never the one `latest`
+    names.
+    """
+
+    def __init__(self, directory='./checkpoints', keep=2):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self.thread = None
+        self.error = None
+
+    def wait(self):
+        # Blocks until the write in flight (if any) is done, re-raises its error
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _start(self, target, *args):
+        # One write at a time, a new save waits for the previous one
+        self.wait()
+
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                self.error = e
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def save_model(self, model, path='./model/model.pth'):
+        # Async, atomic replacement for QNet.save
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._start(atomic_save, _cpu_copy(model.state_dict()), path)
+
+    def save(self, step, state, memory=None):
+        # state is a dict of state_dicts / plain values (see Agent.state_dict), step numbers the checkpoint
+        name = f'ckpt_{step:08d}'
+        snapshot = memory.snapshot() if memory is not None else None
+        self._start(self._write, name, _cpu_copy(state), snapshot)
+
+    def _write(self, name, state, snapshot):
+        base = os.path.join(self.directory, name)
+        if snapshot is not None:
+            tmp = base + '.memory.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            ReplayBuffer.write_snapshot(tmp, snapshot)
+            shutil.rmtree(base + '.memory', ignore_errors=True)
+            os.replace(tmp, base + '.memory')
+            state['memory'] = name + '.memory'
+        atomic_save(state, base + '.pth')
+        _atomic_write_text(os.path.join(self.directory, LATEST), name)
+        self._prune()
+
+    def _checkpoints(self):
+        # Names of the checkpoints in the directory, oldest write first
+        # (by write time, not by number: a new run numbers its checkpoints from 0 again)
+        paths = [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                 if f.startswith('ckpt_') and f.endswith('.pth')]
+        paths.sort(key=lambda p: (os.stat(p).st_mtime_ns, p))
+        return [os.path.basename(p)[:-4] for p in paths]
+
+    def has_checkpoints(self):
+        return bool(self._checkpoints())
+
+    def _prune(self):
+        latest = self.latest()
+        names = [n for n in self._checkpoints() if os.path.join(self.directory, n + '.pth') != latest]
+        for name in names[:max(0, len(names) - (self.keep - 1))]:
+            base = os.path.join(self.directory, name)
+            os.remove(base + '.pth')
+            shutil.rmtree(base + '.memory', ignore_errors=True)
+
+    def latest(self):
+        # Path of the newest complete checkpoint, None if there isn't one
+        try:
+            with open(os.path.join(self.directory, LATEST)) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.directory, name + '.pth')
+
+    def load_latest(self, memory=None, map_location='cpu'):
+        # Returns the newest checkpoint's state (None if there is none), refilling memory if it was saved
+        path = self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, map_location=map_location, weights_only=False)
+        if memory is not None and 'memory' in state:
+            memory.load(os.path.join(self.directory, state['memory']))
+        return state
@@ -0,0 +1,96 @@
+import random
+from collections import deque, namedtuple
+
+import numpy as np
+
+from levelgen import generate_level
+from sokobanbot import Sokoban
+
+# Board size, block count and difficulty of one stage of the curriculum
+# pushes: levels are generated by levelgen with this many pulls (solvable by construction), None = random placement
+# level_pool: draw levels from this pool / collection file instead
+Tier = namedtuple('Tier', 'w, h, num_objects, pushes, level_pool', defaults=(None, None))
+
+DEFAULT_TIERS = (
+    Tier(5, 5, 1, 4),
+    Tier(7, 7, 1, 8),
+    Tier(7, 7, 2, 8),
+    Tier(9, 9, 2, 12),
+    Tier(9, 9, 3, 16),
+    Tier(9, 9, 4, 20),
+)
+
+
+class Curriculum:
+    """
+    Moves training from easy tiers to harder ones as the agent masters them.
+
+    Keeps the last `window` results of every tier. Once the current tier is solved at least promote_rate
+    of the time (and, if max_avg_moves is set, in at most that many moves on average) over a full window,
+    the next tier unlocks. A `mix` fraction of games is drawn from the tiers already passed, so they
+    aren't forgotten.
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, window=75, promote_rate=0.8, max_avg_moves=None, mix=0.2, seed=None):
+        self.tiers = list(tiers)
+        self.window = window
+        self.promote_rate = promote_rate
+        self.max_avg_moves = max_avg_moves
+        self.mix = mix
+        self.current = 0
+        self.rng = random.Random(seed)
+        # (won, moves) of the last `window` games of every tier
+        self.results = [deque(maxlen=window) for _ in self.tiers]
+        # One game per tier, boards of different sizes can't share one
+        self.games = [Sokoban(t.w, t.h, t.num_objects, level_pool=t.level_pool) for t in self.tiers]
+
+    def solve_rate(self, tier):
+        results = self.results[tier]
+        return sum(won for won, _ in results) / len(results) if results else 0.0
+
+    def avg_moves(self, tier):
+        # Average moves of the won games in the window, None if there are none
+        moves = [m for won, m in self.results[tier] if won]
+        return sum(moves) / len(moves) if moves else None
+
+    def next_game(self):
+        # Picks the tier of the next game and resets its board, returns (tier index, game)
+        tier = self.current
+        if self.current and self.rng.random() < self.mix:
+            tier = self.rng.randrange(self.current)
+
+        game = self.games[tier]
+        t = self.tiers[tier]
+        if t.pushes and t.level_pool is None:
+            grid, _ = generate_level(t.w, t.h, t.num_objects, t.pushes, rng=self.rng)
+            game.reset(grid=grid)
+        else:
+            game.reset()
+        return tier, game
+
+    def record(self, tier, won, moves):
+        # Adds a finished game, returns True if it promoted the curriculum to the next tier
+        self.results[tier].append((bool(won), int(moves)))
+        if tier != self.current or self.current == len(self.tiers) - 1:
+            return False
+        if len(self.results[tier]) < self.window or self.solve_rate(tier) < self.promote_rate:
+            return False
+        avg = self.avg_moves(tier)
+        if self.max_avg_moves is not None and (avg is None or avg > self.max_avg_moves):
+            return False
+        self.current += 1
+        return True
+
+    def state_dict(self):
+        return {'current': self.current, 'results': [list(r) for r in self.results]}
+
+    def load_state_dict(self, state):
+        self.current = state['current']
+        for results, saved in zip(self.results, state['results']):
+            results.clear()
+            results.extend(tuple(r) for r in saved)
+
+    def board_bounds(self):
+        # Largest (w, h, num_objects) over all tiers, what the model has to be sized for
+        sizes = np.array([(t.w, t.h, t.num_objects) for t in self.tiers])
+        return tuple(int(v) for v in sizes.max(axis=0))
@@ -0,0 +1,111 @@
+from collections import deque
+
+import numpy as np
+
+# Grids use the same layout as sokobanbot.Sokoban (indexed [y, x], block_grid holds block ids >= 0, -1 if empty)
+
+# (dx, dy) of the four moves
+DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+
+def _is_wall(walls, x, y):
+    # Off the board counts as a wall
+    h, w = walls.shape
+    return not (0 <= x < w and 0 <= y < h) or walls[y, x]
+
+
+def push_distances(walls, holes):
+    """
+    Fewest pushes to get a block from each cell onto each hole, as a (holes, h, w) float array.
+
+    Found by pulling a block backwards from one hole at a time: a block at c can be pulled to c + d when
+    both c + d and c + 2d (where the player ends up) are floor. Cells a block can't be pushed from onto
+    that hole are inf, so floor cells that are inf for every hole are the dead squares. Other blocks are
+    ignored since they move during the game.
+    """
+    h, w = walls.shape
+    dist = np.full((len(holes), h, w), np.inf)
+
+    for j, (hx, hy) in enumerate(holes):
+        field = dist[j]
+        field[hy, hx] = 0
+        queue = deque([(hx, hy)])
+        while queue:
+            x, y = queue.popleft()
+            for dx, dy in DIRECTIONS:
+                nx, ny = x + dx, y + dy
+                if _is_wall(walls, nx, ny) or field[ny, nx] != np.inf or _is_wall(walls, nx + dx, ny + dy):
+                    continue
+                field[ny, nx] = field[y, x] + 1
+                queue.append((nx, ny))
+
+    return dist
+
+
+def _axis_blocked(walls, dead, block_grid, x, y, dx, dy, checked, frozen_blocks):
+    # True if the block at (x, y) can't move along the (dx, dy) axis
+    a = (x - dx, y - dy)
+    b = (x + dx, y + dy)
+
+    if _is_wall(walls, *a) or _is_wall(walls, *b):
+        return True
+    # pushing either way would put the block on a dead square
+    if dead[a[1], a[0]] and dead[b[1], b[0]]:
+        return True
+
+    for cx, cy in (a, b):
+        # blocks already being checked count as walls, otherwise a neighbouring frozen block blocks this one
+        if (cx, cy) in checked:
+            return True
+        if block_grid[cy, cx] >= 0 and _frozen(walls, dead, block_grid, cx, cy, checked, frozen_blocks):
+            return True
+
+    return False
+
+
+def _frozen(walls, dead, block_grid, x, y, checked, frozen_blocks):
+    checked.add((x, y))
+    frozen = (_axis_blocked(walls, dead, block_grid, x, y, 1, 0, checked, frozen_blocks)
+              and _axis_blocked(walls, dead, block_grid, x, y, 0, 1, checked, frozen_blocks))
+    if frozen:
+        frozen_blocks.append((x, y))
+    return frozen
+
+
+def freeze_deadlock(walls, dead, block_grid, hole_grid, x, y):
+    # True if the block at (x, y) can never move again and it, or a block frozen with it, is not on a hole
+    frozen_blocks = []
+    if not _frozen(walls, dead, block_grid, x, y, set(), frozen_blocks):
+        return False
+    return any(not hole_grid[by, bx] for bx, by in frozen_blocks)
+
+
+def square_deadlock(walls, block_grid, hole_grid, x, y):
+    # True if one of the four 2x2 squares containing (x, y) is all walls / blocks with a block not on a hole
+    for ox in (x - 1, x):
+        for oy in (y - 1, y):
+            cells = ((ox, oy), (ox + 1, oy), (ox, oy + 1), (ox + 1, oy + 1))
+            loose = False
+            for cx, cy in cells:
+                if _is_wall(walls, cx, cy):
+                    continue
+                if block_grid[cy, cx] < 0:
+                    break
+                loose = loose or not hole_grid[cy, cx]
+            else:
+                if loose:
+                    return True
+    return False
+
+
+def block_deadlocked(walls, dead, block_grid, hole_grid, x, y):
+    # All the checks for a single block, only needs to run for the block that was just pushed
+    # (holes are never dead squares, a block on a hole can still freeze a neighbour that isn't on one)
+    return (bool(dead[y, x])
+            or square_deadlock(walls, block_grid, hole_grid, x, y)
+            or freeze_deadlock(walls, dead, block_grid, hole_grid, x, y))
+
+
+def any_block_deadlocked(walls, dead, block_grid, hole_grid, blocks):
+    # Full check over every block, used when a level is first loaded
+    return any(block_deadlocked(walls, dead, block_grid, hole_grid, x, y) for x, y in blocks)
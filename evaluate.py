@@ -0,0 +1,215 @@
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from levelgen import generate_level
+from levelset import open_levels
+from model import load_model, ConvQNet
+from sokobanbot import Sokoban, ACTIONS
+
+# How a greedy game on a level ended
+OUTCOMES = ('solved', 'dead_end', 'loop', 'move_limit')
+
+# Model and board of the current worker process, set once by _init_worker
+_worker = {}
+
+
+def make_levels(count, w=9, h=9, num_objects=1, seed=0, pushes=None, level_pool=None):
+    """
+    The fixed evaluation set for seed: a list of count uint8 level grids, plus their pool ids (None if generated).
+
+    Levels come from level_pool (a seeded sample of the levels that fit the board), from levelgen with
+    `pushes` pulls if that is set, or from Sokoban's random placement otherwise. The same arguments always
+    give the same levels, so checkpoints are scored on identical boards.
+    """
+    rng = random.Random(seed)
+    if level_pool is not None:
+        levels = open_levels(level_pool)
+        sizes = levels.sizes
+        fits = np.flatnonzero((sizes[:, 0] <= w) & (sizes[:, 1] <= h) & (sizes[:, 2] == num_objects))
+        ids = rng.sample(fits.tolist(), min(count, len(fits)))
+        return [np.array(levels[i]) for i in ids], ids
+    if pushes:
+        return [generate_level(w, h, num_objects, pushes, rng=rng)[0] for _ in range(count)], None
+
+    # Sokoban places levels with the global random module, seed it for the draw and put it back after
+    state = random.getstate()
+    try:
+        random.seed(seed)
+        game = Sokoban(w, h, num_objects)
+        grids = []
+        for _ in range(count):
+            game.reset()
+            grids.append(game.level_grid())
+    finally:
+        random.setstate(state)
+    return grids, None
+
+
+def _init_worker(model_path, w, h, num_objects, macro_actions, mask_actions, threads):
+    torch.set_num_threads(threads)
+    model = load_model(model_path)
+    _worker.update(
+        model=model,
+        board_size=model.board_size if isinstance(model, ConvQNet) else None,
+        macro=macro_actions,
+        game=Sokoban(w, h, num_objects),
+        mask_actions=mask_actions,
+    )
+
+
+def play_greedy(game, model, board_size=None, macro=False, mask_actions=False, max_moves=1600):
+    """
+    Plays the level loaded in game with the greedy policy of model, returns (outcome, moves).
+
+    The policy is deterministic, so coming back to a board already seen this game means it will loop
+    forever: the game stops there as 'loop' instead of running into the move limit.
+    """
+    seen = set()
+    moves = 0
+    while True:
+        board = game.level_grid().tobytes()
+        if board in seen:
+            return 'loop', moves
+        seen.add(board)
+
+        state = game.grid_state(board_size) if board_size else game.feature_state()
+        with torch.inference_mode():
+            q = model(torch.as_tensor(state, dtype=torch.float).unsqueeze(0))[0].numpy()
+        if mask_actions:
+            mask = game.legal_moves(macro)
+            if mask.any():
+                q = np.where(mask, q, -np.inf)
+        action = int(np.argmax(q))
+
+        if macro:
+            _, game_over, win, made = game.push_step(action)
+        else:
+            _, game_over, win = game.play_step(ACTIONS[action])
+            made = 1
+        moves += made
+
+        if game_over:
+            if win:
+                return 'solved', moves
+            # play_step also ends a game on its own move limit, only a stuck block counts as a dead end
+            if game.dead_on_arrival or game.immovable_block_detect():
+                return 'dead_end', moves
+            return 'move_limit', moves
+        if moves >= max_moves:
+            return 'move_limit', moves
+
+
+def _evaluate_chunk(start, grids, max_moves):
+    game = _worker['game']
+    results = []
+    for i, grid in enumerate(grids, start):
+        game.reset(grid=grid)
+        outcome, moves = play_greedy(game, _worker['model'], _worker['board_size'], _worker['macro'],
+                                     _worker['mask_actions'], max_moves)
+        results.append({'level': i, 'outcome': outcome, 'moves': moves})
+    return results
+
+
+def summarise(results):
+    # Rates of every outcome and move statistics of the solved levels
+    n = len(results)
+    summary = {'levels': n}
+    for outcome in OUTCOMES:
+        name = 'solve' if outcome == 'solved' else outcome
+        summary[f'{name}_rate'] = sum(r['outcome'] == outcome for r in results) / n if n else 0.0
+    moves = np.array([r['moves'] for r in results if r['outcome'] == 'solved'])
+    summary['moves_mean'] = float(moves.mean()) if len(moves) else None
+    for p in (50, 90, 99):
+        summary[f'moves_p{p}'] = float(np.percentile(moves, p)) if len(moves) else None
+    return summary
+
+
+def evaluate(model_path, count=1000, w=9, h=9, num_objects=1, seed=0, pushes=None, level_pool=None,
+             workers=None, macro_actions=False, mask_actions=False, max_moves=1600):
+    """
+    Scores a model or checkpoint by greedy play over the fixed level set of make_levels.
+
+    Levels are split into chunks over a pool of `workers` processes (all cores by default, each with one
+    torch thread), workers=1 plays them in this process. macro_actions has to match how the model was trained
+    (Agent(macro_actions=True) outputs one push per block and direction), the output size can't tell: a 1 block
+    macro model has 4 outputs too. Returns the summary (see summarise) with the settings and every level's
+    outcome under 'results'.
+    """
+    outputs = load_model(model_path).linear2.out_features
+    expected = 4 * num_objects if macro_actions else 4
+    if outputs != expected:
+        raise ValueError(f'{model_path} has {outputs} outputs, {"pushes" if macro_actions else "moves"} '
+                         f'with {num_objects} blocks need {expected}')
+
+    started = time.perf_counter()
+    grids, ids = make_levels(count, w, h, num_objects, seed, pushes, level_pool)
+    workers = workers or os.cpu_count() or 1
+    settings = (model_path, w, h, num_objects, macro_actions, mask_actions, 1)
+
+    if workers == 1:
+        _init_worker(*settings)
+        results = _evaluate_chunk(0, grids, max_moves)
+    else:
+        # A few chunks per worker so slow levels don't leave the others idle at the end
+        size = max(1, math.ceil(len(grids) / (workers * 4)))
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=settings) as pool:
+            chunks = [pool.submit(_evaluate_chunk, i, grids[i:i + size], max_moves)
+                      for i in range(0, len(grids), size)]
+            results = [r for chunk in chunks for r in chunk.result()]
+
+    if ids is not None:
+        for r in results:
+            r['pool_id'] = ids[r['level']]
+
+    report = {
+        'model': model_path,
+        'w': w, 'h': h, 'num_objects': num_objects, 'seed': seed, 'pushes': pushes, 'level_pool': level_pool,
+        'macro_actions': macro_actions, 'mask_actions': mask_actions, 'max_moves': max_moves,
+    }
+    report.update(summarise(results))
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    report['results'] = results
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score models or checkpoints by greedy play on a fixed, seeded level set')
+    parser.add_argument('models', nargs='+', help='model.pth state_dicts or training checkpoints')
+    parser.add_argument('--levels', type=int, default=1000)
+    parser.add_argument('--w', type=int, default=9)
+    parser.add_argument('--h', type=int, default=9)
+    parser.add_argument('--blocks', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pushes', type=int, default=None, help='generate levels with levelgen at this difficulty')
+    parser.add_argument('--level-pool', default=None, help='sample levels from a levelgen pool or levelset collection')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default one per core')
+    parser.add_argument('--macro-actions', action='store_true', help='the model picks pushes (Agent macro_actions)')
+    parser.add_argument('--mask-actions', action='store_true', help='only pick legal moves')
+    parser.add_argument('--max-moves', type=int, default=1600)
+    parser.add_argument('--out', default=None, help='JSON results, default <model>.eval.json next to each model')
+    args = parser.parse_args()
+
+    for path in args.models:
+        report = evaluate(path, args.levels, args.w, args.h, args.blocks, args.seed, args.pushes, args.level_pool,
+                          args.workers, args.macro_actions, args.mask_actions, args.max_moves)
+        out = args.out if args.out and len(args.models) == 1 else os.path.splitext(path)[0] + '.eval.json'
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        moves = ', '.join(f'{k[6:]} {report[k]:.1f}' for k in ('moves_mean', 'moves_p50', 'moves_p90', 'moves_p99')
+                          if report[k] is not None)
+        print(f'{path}: solved {100 * report["solve_rate"]:.1f}%, dead ends {100 * report["dead_end_rate"]:.1f}%, '
+              f'loops {100 * report["loop_rate"]:.1f}%, move limit {100 * report["move_limit_rate"]:.1f}% '
+              f'of {report["levels"]} levels in {report["seconds"]}s' + (f' (moves {moves})' if moves else ''))
+        print(f'  wrote {out}')
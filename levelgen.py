@@ -0,0 +1,221 @@
+import random
+import struct
+from collections import deque
+
+import numpy as np
+
+from sokobanbot import WALL, HOLE, BLOCK, PLAYER
+
+# (dx, dy) of the four moves
+MOVES = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+# Pool file layout: header, then a uint16 push count per level, then every level as an (h, w) uint8 grid
+POOL_MAGIC = b'SOKP'
+POOL_VERSION = 1
+HEADER = struct.Struct('<4sIIIII')  # magic, version, w, h, num_objects, count
+
+
+def _random_walls(w, h, wall_density, rng):
+    # Random walls, then every floor cell outside the largest connected area is walled in too
+    walls = np.array([[rng.random() < wall_density for _ in range(w)] for _ in range(h)], dtype=bool)
+
+    best = set()
+    seen = set()
+    for y in range(h):
+        for x in range(w):
+            if walls[y, x] or (x, y) in seen:
+                continue
+            area = {(x, y)}
+            queue = deque([(x, y)])
+            while queue:
+                cx, cy = queue.popleft()
+                for dx, dy in MOVES:
+                    n = (cx + dx, cy + dy)
+                    if 0 <= n[0] < w and 0 <= n[1] < h and not walls[n[1], n[0]] and n not in area:
+                        area.add(n)
+                        queue.append(n)
+            seen |= area
+            if len(area) > len(best):
+                best = area
+
+    walls[:] = True
+    for x, y in best:
+        walls[y, x] = False
+    return walls
+
+
+def _pull_walk(walls, boxes, player, pushes, rng, max_steps):
+    """
+    Plays backwards from player with the blocks at boxes (a set, changed in place) until `pushes` pulls are made.
+
+    Pulls the block behind the player when it can (most of the time), otherwise walks along a shortest
+    path to a random cell a pull can be made from, with the odd random step in between. Pulling a block
+    straight back the way it just came would undo the last pull, so that isn't allowed. Returns the
+    player's cell and the number of pulls made, fewer than pushes if every block got stuck or max_steps ran out.
+    """
+    h, w = walls.shape
+    # direction of the last pull of the block at each cell
+    last_pull = {}
+
+    def free(x, y):
+        return 0 <= x < w and 0 <= y < h and not walls[y, x] and (x, y) not in boxes
+
+    def pulls_from(x, y):
+        # directions the player at (x, y) can pull a block in
+        return [(dx, dy) for dx, dy in MOVES
+                if free(x + dx, y + dy) and (x - dx, y - dy) in boxes
+                and last_pull.get((x - dx, y - dy)) != (-dx, -dy)]
+
+    pulls = 0
+    steps = 0
+    while pulls < pushes and steps < max_steps:
+        px, py = player
+        options = pulls_from(px, py)
+        if options and rng.random() < 0.8:
+            dx, dy = rng.choice(options)
+            boxes.remove((px - dx, py - dy))
+            boxes.add(player)
+            last_pull.pop((px - dx, py - dy), None)
+            last_pull[player] = (dx, dy)
+            player = (px + dx, py + dy)
+            pulls += 1
+            steps += 1
+            continue
+
+        if rng.random() < 0.25:
+            dx, dy = rng.choice(MOVES)
+            if free(px + dx, py + dy):
+                player = (px + dx, py + dy)
+            steps += 1
+            continue
+
+        # Walk to a random reachable cell a pull can be made from
+        parent = {player: None}
+        queue = deque([player])
+        spots = []
+        while queue:
+            x, y = queue.popleft()
+            if (x, y) != player and pulls_from(x, y):
+                spots.append((x, y))
+            for dx, dy in MOVES:
+                n = (x + dx, y + dy)
+                if n not in parent and free(*n):
+                    parent[n] = (x, y)
+                    queue.append(n)
+        if not spots:
+            if not options:
+                break  # no pull can be made anywhere
+            continue
+        path = []
+        cell = rng.choice(spots)
+        while cell != player:
+            path.append(cell)
+            cell = parent[cell]
+        player = path[0]
+        steps += len(path)
+
+    return player, pulls
+
+
+def generate_level(w=9, h=9, num_objects=1, pushes=10, wall_density=0.0, rng=random, max_tries=100):
+    """
+    Makes a level that is solvable by construction, returns (uint8 grid, number of pulls).
+
+    Starts from the solved board (every block on a hole) and plays backwards with _pull_walk until
+    `pushes` pulls are made. Every pull is a push in reverse, so the pulls replayed backwards solve the
+    level, and `pushes` works as the target difficulty. A walk that gets stuck short of it is thrown away
+    and retried. If max_tries walks all fall short (a board too small or walled in for that many pulls)
+    the one with the most pulls is returned, the pull count says how far it got.
+    """
+    best = None
+    for _ in range(max_tries):
+        walls = _random_walls(w, h, wall_density, rng) if wall_density else np.zeros((h, w), dtype=bool)
+        floor = [(x, y) for y in range(h) for x in range(w) if not walls[y, x]]
+        if len(floor) < num_objects + 1:
+            continue
+
+        holes = rng.sample(floor, num_objects)
+        boxes = set(holes)
+        player = rng.choice([c for c in floor if c not in boxes])
+        player, pulls = _pull_walk(walls, boxes, player, pushes, rng, pushes * 50)
+
+        if boxes == set(holes) or (best is not None and pulls <= best[1]):
+            continue
+
+        grid = walls.astype(np.uint8) * WALL
+        for x, y in holes:
+            grid[y, x] |= HOLE
+        for x, y in boxes:
+            grid[y, x] |= BLOCK
+        grid[player[1], player[0]] |= PLAYER
+        best = grid, pulls
+        if pulls >= pushes:
+            break
+
+    if best is None:
+        raise RuntimeError(f'Could not generate a {w}x{h} level with {num_objects} blocks')
+    return best
+
+
+def write_pool(path, levels, pushes, num_objects):
+    # levels is an (count, h, w) uint8 array of level grids, pushes the difficulty of each
+    levels = np.asarray(levels, dtype=np.uint8)
+    count, h, w = levels.shape
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(POOL_MAGIC, POOL_VERSION, w, h, num_objects, count))
+        f.write(np.asarray(pushes, dtype='<u2').tobytes())
+        f.write(levels.tobytes())
+
+
+class LevelPool:
+    """
+    Levels stored by write_pool, memory mapped so opening a pool and drawing a level are both O(1).
+
+    pool[i] is the (h, w) uint8 grid of level i, ready for Sokoban.load_level.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, self.w, self.h, self.num_objects, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != POOL_MAGIC or version != POOL_VERSION:
+            raise ValueError(f'{path} is not a level pool file')
+
+        self.path = path
+        self.pushes = np.memmap(path, dtype='<u2', mode='r', offset=HEADER.size, shape=(count,))
+        self.levels = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.size + 2 * count,
+                                shape=(count, self.h, self.w))
+        # (w, h, num_objects) of every level, same as levelset.LevelCollection
+        self.sizes = np.tile([self.w, self.h, self.num_objects], (count, 1))
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, level_id):
+        return self.levels[level_id]
+
+
+def generate_pool(path, count, w=9, h=9, num_objects=1, pushes=10, wall_density=0.0, seed=0):
+    rng = random.Random(seed)
+    levels = np.zeros((count, h, w), dtype=np.uint8)
+    pulls = np.zeros(count, dtype=np.uint16)
+    for i in range(count):
+        levels[i], pulls[i] = generate_level(w, h, num_objects, pushes, wall_density, rng)
+    write_pool(path, levels, pulls, num_objects)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a pool of solvable levels for Sokoban(level_pool=...)')
+    parser.add_argument('path')
+    parser.add_argument('--count', type=int, default=10_000)
+    parser.add_argument('--w', type=int, default=9)
+    parser.add_argument('--h', type=int, default=9)
+    parser.add_argument('--boxes', type=int, default=1)
+    parser.add_argument('--pushes', type=int, default=10, help='pulls made from the solved board (difficulty)')
+    parser.add_argument('--walls', type=float, default=0.0, help='fraction of cells that start as walls')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_pool(args.path, args.count, args.w, args.h, args.boxes, args.pushes, args.walls, args.seed)
+    print(f'Wrote {args.count} levels to {args.path}')
@@ -0,0 +1,188 @@
+import os
+import struct
+from collections import deque
+
+import numpy as np
+
+from levelgen import LevelPool, POOL_MAGIC, MOVES
+from sokobanbot import WALL, HOLE, BLOCK, PLAYER
+
+# XSB characters, '-' and '_' are alternative floor characters
+XSB_FLAGS = {
+    '#': WALL,
+    ' ': 0, '-': 0, '_': 0,
+    '.': HOLE,
+    '$': BLOCK,
+    '*': BLOCK | HOLE,
+    '@': PLAYER,
+    '+': PLAYER | HOLE,
+}
+
+# Collection file layout: header, then an index entry per level, then every level's grid packed back to back
+COLLECTION_MAGIC = b'SOKC'
+COLLECTION_VERSION = 1
+HEADER = struct.Struct('<4sIQ')  # magic, version, count
+INDEX = np.dtype([('offset', '<u8'), ('w', '<u2'), ('h', '<u2'), ('num_objects', '<u2')])
+
+
+def _is_map_line(line):
+    return '#' in line and all(c in XSB_FLAGS for c in line)
+
+
+def xsb_to_grid(rows):
+    """
+    uint8 WALL / HOLE / BLOCK / PLAYER grid of one XSB level given as its rows of text, None if it isn't playable.
+
+    Short rows are padded, and every cell the player can't reach from the inside (the area outside
+    the outer wall) becomes wall.
+    """
+    h = len(rows)
+    w = max(len(row) for row in rows)
+    grid = np.zeros((h, w), dtype=np.uint8)
+    for y, row in enumerate(rows):
+        for x, c in enumerate(row):
+            grid[y, x] = XSB_FLAGS[c]
+
+    players = np.argwhere(grid & PLAYER)
+    if len(players) != 1 or ((grid & BLOCK) != 0).sum() != ((grid & HOLE) != 0).sum() or not (grid & BLOCK).any():
+        return None
+
+    # Flood fill from the player, blocks don't stop it since they can be pushed out of the way
+    inside = np.zeros((h, w), dtype=bool)
+    py, px = players[0]
+    inside[py, px] = True
+    queue = deque([(px, py)])
+    while queue:
+        x, y = queue.popleft()
+        for dx, dy in MOVES:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < w and 0 <= ny < h and not inside[ny, nx] and not grid[ny, nx] & WALL:
+                inside[ny, nx] = True
+                queue.append((nx, ny))
+
+    if (grid[~inside] & (BLOCK | HOLE)).any():
+        return None
+    grid[~inside] = WALL
+    return grid
+
+
+def parse_xsb(text):
+    """
+    Every level in an XSB / Boxoban text file as a list of grids (see xsb_to_grid), plus the number skipped.
+
+    A level is a run of map lines, anything else (titles, '; 123' headers, comments, blank lines) ends it.
+    Levels without exactly one player, with different numbers of blocks and holes or with pieces outside their
+    walls are skipped.
+    """
+    levels = []
+    skipped = 0
+    rows = []
+    for line in text.splitlines() + ['']:
+        line = line.rstrip('\r\n')
+        if _is_map_line(line):
+            rows.append(line)
+            continue
+        if rows:
+            grid = xsb_to_grid(rows)
+            if grid is None:
+                skipped += 1
+            else:
+                levels.append(grid)
+            rows = []
+    return levels, skipped
+
+
+def write_collection(path, levels):
+    # levels is a list of (h, w) uint8 grids of any sizes
+    index = np.zeros(len(levels), dtype=INDEX)
+    offset = HEADER.size + index.nbytes
+    for i, grid in enumerate(levels):
+        h, w = grid.shape
+        index[i] = (offset, w, h, ((grid & BLOCK) != 0).sum())
+        offset += grid.size
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(COLLECTION_MAGIC, COLLECTION_VERSION, len(levels)))
+        f.write(index.tobytes())
+        for grid in levels:
+            f.write(np.ascontiguousarray(grid, dtype=np.uint8).tobytes())
+
+
+class LevelCollection:
+    """
+    Levels of any size packed by write_collection, memory mapped so fetching level i is O(1) and nothing is parsed.
+
+    collection[i] is the (h, w) uint8 grid of level i, sizes is the (count, 3) array of every level's
+    (w, h, num_objects), same as LevelPool so Sokoban(level_pool=...) takes either.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != COLLECTION_MAGIC or version != COLLECTION_VERSION:
+            raise ValueError(f'{path} is not a level collection file')
+
+        self.path = path
+        self.index = np.memmap(path, dtype=INDEX, mode='r', offset=HEADER.size, shape=(count,))
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.sizes = np.stack([self.index['w'], self.index['h'], self.index['num_objects']], axis=1).astype(np.int64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, level_id):
+        offset, w, h, _ = self.index[level_id]
+        return self.data[offset:offset + int(w) * int(h)].reshape(int(h), int(w))
+
+
+def open_levels(path):
+    # LevelPool or LevelCollection depending on the file's magic
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic == POOL_MAGIC:
+        return LevelPool(path)
+    return LevelCollection(path)
+
+
+def pack(path, sources):
+    # Parses every XSB file in sources (files or directories of .txt / .xsb / .sok files) into one collection
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files += sorted(os.path.join(source, f) for f in os.listdir(source)
+                            if f.lower().endswith(('.txt', '.xsb', '.sok')))
+        else:
+            files.append(source)
+
+    levels = []
+    skipped = 0
+    for file in files:
+        with open(file) as f:
+            parsed, bad = parse_xsb(f.read())
+        levels += parsed
+        skipped += bad
+    write_collection(path, levels)
+    return len(levels), skipped
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pack XSB / Boxoban level files into a memory mapped collection')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack_parser = commands.add_parser('pack', help='parse level files into a collection')
+    pack_parser.add_argument('path')
+    pack_parser.add_argument('sources', nargs='+', help='level files or directories of them')
+    info_parser = commands.add_parser('info', help='summarise a collection or pool')
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        count, skipped = pack(args.path, args.sources)
+        print(f'Wrote {count} levels to {args.path}' + (f', skipped {skipped} unplayable' if skipped else ''))
+    else:
+        levels = open_levels(args.path)
+        print(f'{len(levels)} levels')
+        sizes, counts = np.unique(levels.sizes, axis=0, return_counts=True)
+        for (w, h, num_objects), count in zip(sizes, counts):
+            print(f'  {w}x{h}, {num_objects} blocks: {count}')
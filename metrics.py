@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+# Sentinel that tells the writer thread to finish
+_STOP = object()
+
+
+class MetricsLogger:
+    """
+    Records training scalars to a CSV or JSONL file (picked from path's extension) from a background thread.
+
+    log() only stamps the row and puts it on a queue, so the training loop never waits on disk or a plot.
+    The writer drains the queue and flushes every flush_every seconds. CSV columns are taken from the
+    first row logged. append adds to an existing file instead of starting it over (a resumed run), keeping
+    its CSV columns. Plot a run afterwards with `python metrics.py plot <path>`.
+    """
+
+    def __init__(self, path, flush_every=1.0, append=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.jsonl = path.endswith('.jsonl')
+        self.flush_every = flush_every
+        self.append = append
+        self.start = time.perf_counter()
+        self.rows = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, **scalars):
+        scalars['time'] = round(time.perf_counter() - self.start, 3)
+        self.rows.put(scalars)
+
+    def close(self):
+        self.rows.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        fieldnames = None
+        if self.append and not self.jsonl and os.path.exists(self.path) and os.path.getsize(self.path):
+            # Carry on under the existing header
+            with open(self.path, newline='') as f:
+                fieldnames = next(csv.reader(f), None)
+
+        with open(self.path, 'a' if self.append else 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore') if fieldnames else None
+            last_flush = time.perf_counter()
+            while True:
+                try:
+                    row = self.rows.get(timeout=self.flush_every)
+                except queue.Empty:
+                    row = None
+
+                if row is _STOP:
+                    break
+                if row is not None:
+                    if self.jsonl:
+                        f.write(json.dumps(row) + '\n')
+                    else:
+                        if writer is None:
+                            writer = csv.DictWriter(f, fieldnames=list(row), extrasaction='ignore')
+                            writer.writeheader()
+                        writer.writerow(row)
+
+                if time.perf_counter() - last_flush >= self.flush_every:
+                    f.flush()
+                    last_flush = time.perf_counter()
+
+
+def read_metrics(path):
+    # Rows of a CSV or JSONL metrics file as dicts of floats (empty cells are skipped)
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return [{k: float(v) for k, v in row.items() if v not in ('', None)} for row in csv.DictReader(f)]
+
+
+def plot(path, y='avg_moves', x='games', out=None):
+    # Offline replacement for the plot train used to draw while training
+    import matplotlib
+    if out:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    rows = [row for row in read_metrics(path) if y in row and x in row]
+    plt.plot([row[x] for row in rows], [row[y] for row in rows])
+    plt.xlabel(x)
+    plt.ylabel(y)
+    if out:
+        plt.savefig(out)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Tools for metrics files written during training')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plot_parser = commands.add_parser('plot', help='plot one metric of a run')
+    plot_parser.add_argument('path')
+    plot_parser.add_argument('--y', default='avg_moves')
+    plot_parser.add_argument('--x', default='games')
+    plot_parser.add_argument('--out', default=None, help='save the figure to this file instead of showing it')
+    args = parser.parse_args()
+
+    plot(args.path, args.y, args.x, args.out)
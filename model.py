@@ -4,8 +4,19 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 import os
+import copy
 
-class Linear_QNet(nn.Module):
+class QNet(nn.Module):
+    def save(self, file_name='model.pth'):
+        model_folder_path = './model'
+        if not os.path.exists(model_folder_path):
+            os.makedirs(model_folder_path)
+        
+        file_name = os.path.join(model_folder_path, file_name)
+        torch.save(self.state_dict(), file_name)
+
+
+class Linear_QNet(QNet):
     def __init__(self, input_size, hidden_size, output_size):
         super().__init__()
 
@@ -16,40 +27,109 @@ class Linear_QNet(nn.Module):
         x = F.relu(self.linear1(x))
         x = self.linear2(x)
         return x
-    
-    def save(self, file_name='model.pth'):
-        model_folder_path = './model'
-        if not os.path.exists(model_folder_path):
-            os.makedirs(model_folder_path)
-        
-        file_name = os.path.join(model_folder_path, file_name)
-        torch.save(self.state_dict(), file_name)
+
+
+class ConvQNet(QNet):
+    # Q-network over Sokoban.grid_state planes, any board up to board_size x board_size with any number of blocks
+    def __init__(self, board_size=9, channels=4, hidden_size=256, output_size=4):
+        super().__init__()
+
+        self.board_size = board_size
+        self.conv1 = nn.Conv2d(channels, 32, 3, padding=1)
+        self.conv2 = nn.Conv2d(32, 64, 3, padding=1)
+        self.linear1 = nn.Linear(64 * board_size * board_size, hidden_size)
+        self.linear2 = nn.Linear(hidden_size, output_size)
+
+    def forward(self, x):
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.linear1(x.flatten(1)))
+        x = self.linear2(x)
+        return x
+
+def load_model(path='./model/model.pth', device='cpu'):
+    # Rebuilds the network a state_dict was saved from (Linear_QNet or ConvQNet) and loads it
+    # path can also be a full training checkpoint (Agent.state_dict, checkpoint.Checkpointer)
+    state_dict = torch.load(path, map_location=device, weights_only=False)
+    if 'model_state' in state_dict:
+        state_dict = state_dict['model_state']
+    if 'conv1.weight' in state_dict:
+        channels = state_dict['conv1.weight'].shape[1]
+        hidden_size, flat_size = state_dict['linear1.weight'].shape
+        board_size = int(round((flat_size / state_dict['conv2.weight'].shape[0]) ** 0.5))
+        model = ConvQNet(board_size, channels, hidden_size, state_dict['linear2.weight'].shape[0])
+    else:
+        hidden_size, input_size = state_dict['linear1.weight'].shape
+        model = Linear_QNet(input_size, hidden_size, state_dict['linear2.weight'].shape[0])
+    model.load_state_dict(state_dict)
+    return model.to(device).eval()
+
 
 class QTrainer:
-    def __init__(self, model, lr, gamma):
+    def __init__(self, model, lr, gamma, target_sync=None, tau=None, double_dqn=False):
         self.lr = lr
         self.gamma = gamma
         self.model = model
         self.optimizer = optim.Adam(model.parameters(), lr=self.lr)
         self.criterion = nn.MSELoss()
 
-    def train_step(self, state_old, final_move, reward, state_new, done):
+        # Optional target network for next-state values:
+        # target_sync = copy the weights over every N updates, tau = Polyak-average them in after every update
+        # double_dqn picks the next action with the online model and values it with the target
+        self.target_sync = target_sync
+        self.tau = tau
+        self.double_dqn = double_dqn
+        self.updates = 0
+        # loss of the last update as a tensor, .item() only when it is read so logging doesn't sync every step
+        self.last_loss = None
+        self.target_model = None
+        if target_sync or tau:
+            self.target_model = copy.deepcopy(model)
+            self.target_model.requires_grad_(False)
+
+    def update_target(self):
+        if self.target_model is None:
+            return
+        with torch.no_grad():
+            if self.tau:
+                for target, param in zip(self.target_model.parameters(), self.model.parameters()):
+                    target.lerp_(param, self.tau)
+            elif self.updates % self.target_sync == 0:
+                self.target_model.load_state_dict(self.model.state_dict())
+
+    def train_step(self, state_old, final_move, reward, state_new, done, next_mask=None):
         # Convert to tensors
         state_old = np.array(state_old)
         state_old = torch.tensor(state_old, dtype=torch.float)
         state_new = np.array(state_new)
         state_new = torch.tensor(state_new, dtype=torch.float)
-        reward = torch.tensor(reward, dtype=torch.float)
-        final_move = torch.tensor(final_move, dtype=torch.long)
-        done = torch.tensor(done, dtype=torch.bool)
+        reward = torch.tensor(np.array(reward), dtype=torch.float)
+        final_move = torch.tensor(np.array(final_move), dtype=torch.long)
+        done = torch.tensor(np.array(done), dtype=torch.bool)
+        if next_mask is not None:
+            next_mask = torch.tensor(np.array(next_mask), dtype=torch.bool)
 
-        # If single sample, add batch dimension
-        if len(state_old.shape) == 1:
+        # If single sample (scalar reward), add batch dimension
+        if reward.dim() == 0:
             state_old = state_old.unsqueeze(0)
             state_new = state_new.unsqueeze(0)
             reward = reward.unsqueeze(0)
             final_move = final_move.unsqueeze(0)
             done = done.unsqueeze(0)
+            if next_mask is not None:
+                next_mask = next_mask.unsqueeze(0)
+
+        action_idx = torch.argmax(final_move, dim=1)  # (batch,)
+
+        device = next(self.model.parameters()).device
+        self.train_batch(state_old.to(device), action_idx.to(device), reward.to(device),
+                         state_new.to(device), done.to(device),
+                         next_mask=next_mask.to(device) if next_mask is not None else None)
+
+    def train_batch(self, state_old, action_idx, reward, state_new, done, weights=None, next_mask=None):
+        # Same update as train_step on ready batched tensors, actions given as indices (e.g. from replay.ReplayBuffer.sample)
+        # weights are optional per-sample loss weights (importance sampling), returns the absolute TD error of every sample
+        # next_mask is an optional (batch, actions) bool of the legal moves in state_new, the max only runs over those
 
         # Current Q-values for state_old
         pred = self.model(state_old)  # shape: (batch, 4)
@@ -58,10 +138,20 @@ class QTrainer:
         target = pred.clone().detach()
 
         with torch.no_grad():
-            next_q = self.model(state_new)  # (batch, 4)
-            max_next_q = torch.max(next_q, dim=1).values  # (batch,)
-
-        action_idx = torch.argmax(final_move, dim=1)  # (batch,)
+            target_model = self.target_model if self.target_model is not None else self.model
+            next_q = target_model(state_new)  # (batch, 4)
+            if next_mask is not None:
+                # a board with no legal move (player boxed in) falls back to every move
+                next_mask = next_mask | ~next_mask.any(dim=1, keepdim=True)
+                next_q = next_q.masked_fill(~next_mask, float('-inf'))
+            if self.double_dqn:
+                online_q = self.model(state_new)
+                if next_mask is not None:
+                    online_q = online_q.masked_fill(~next_mask, float('-inf'))
+                next_action = torch.argmax(online_q, dim=1)
+                max_next_q = next_q.gather(1, next_action.unsqueeze(1)).squeeze(1)  # (batch,)
+            else:
+                max_next_q = torch.max(next_q, dim=1).values  # (batch,)
 
         # Q_new = r if done else r + gamma * max(Q_next)
         q_new = reward + (~done).float() * (self.gamma * max_next_q)
@@ -70,6 +160,15 @@ class QTrainer:
 
         # Optimize
         self.optimizer.zero_grad()
-        loss = self.criterion(pred, target)
+        if weights is None:
+            loss = self.criterion(pred, target)
+        else:
+            loss = (weights.unsqueeze(1) * (pred - target) ** 2).mean()
         loss.backward()
         self.optimizer.step()
+        self.last_loss = loss.detach()
+
+        self.updates += 1
+        self.update_target()
+
+        return (q_new - pred.detach()[torch.arange(target.size(0)), action_idx]).abs()
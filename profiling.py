@@ -0,0 +1,160 @@
+import os
+import time
+
+import numpy as np
+
+# Spans are recorded when SOKOBAN_PROFILE is set (or enable() is called), otherwise span() is a shared no-op
+ENABLED = os.environ.get('SOKOBAN_PROFILE', '') not in ('', '0')
+
+# Histogram buckets are powers of two nanoseconds: bucket b holds durations in [2 ** (b - 1), 2 ** b)
+BUCKETS = 64
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+class _Span:
+    # Accumulates every timing of one phase, not re-entrant (a phase never nests inside itself)
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+        self.count = 0
+        self.total = 0
+        self.histogram = np.zeros(BUCKETS, dtype=np.int64)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        self.count += 1
+        self.total += elapsed
+        self.histogram[min(elapsed.bit_length(), BUCKETS - 1)] += 1
+        return False
+
+    def percentile(self, q):
+        # Upper edge of the bucket holding the q-th percentile, in nanoseconds
+        cumulative = np.cumsum(self.histogram)
+        return 2 ** int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.histogram[:] = 0
+
+
+_spans = {}
+_steps = 0
+# Time and step count at the last report
+_window_start = time.perf_counter()
+_window_steps = 0
+_capture = None
+
+
+def enable(on=True):
+    global ENABLED, _window_start, _window_steps
+    ENABLED = on
+    _window_start = time.perf_counter()
+    _window_steps = _steps
+
+
+def span(name):
+    """
+    Context manager timing one phase of a step, e.g. `with profiling.span('play_step'):`.
+
+    Phases nest by name ('play_step.move' inside 'play_step'), report() shows each as a share of wall time.
+    """
+    if not ENABLED:
+        return _NULL
+    s = _spans.get(name)
+    if s is None:
+        s = _spans[name] = _Span(name)
+    return s
+
+
+def capture(start, steps, kind='cprofile', out='./profiles'):
+    """
+    Runs cProfile (kind='cprofile') or torch.profiler (kind='torch') over steps [start, start + steps).
+
+    Steps are numbered from 0 by the step() calls, step n is the one run after n step() calls, so start=0
+    profiles from the next step on. The profile is written to out when the window closes: a .prof file
+    for snakeviz / pstats, or a Chrome trace for torch.
+    """
+    global _capture
+    if start < _steps:
+        raise ValueError(f'Profile window starts at step {start}, {_steps} steps have already run')
+    if steps < 1:
+        raise ValueError('Profile window needs at least one step')
+    _capture = {'start': start, 'stop': start + steps, 'kind': kind, 'out': out, 'profiler': None}
+    if start == _steps:
+        # step() only starts the profiler after a step, the window opens now
+        _capture_step()
+
+
+def _capture_step():
+    global _capture
+    if _steps == _capture['start']:
+        if _capture['kind'] == 'torch':
+            import torch.profiler
+            profiler = torch.profiler.profile(record_shapes=True)
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        _capture['profiler'] = profiler
+
+    elif _steps == _capture['stop'] and _capture['profiler'] is not None:
+        os.makedirs(_capture['out'], exist_ok=True)
+        profiler = _capture['profiler']
+        if _capture['kind'] == 'torch':
+            profiler.stop()
+            path = os.path.join(_capture['out'], f'torch_{_steps}.json')
+            profiler.export_chrome_trace(path)
+        else:
+            profiler.disable()
+            path = os.path.join(_capture['out'], f'cprofile_{_steps}.prof')
+            profiler.dump_stats(path)
+        print(f'Profile of steps {_capture["start"]}-{_steps} written to {path}')
+        _capture = None
+
+
+def step(report_every=10_000):
+    # Called once per environment step by the training loop, prints a report every report_every steps
+    global _steps
+    if not ENABLED and _capture is None:
+        return
+    _steps += 1
+    if _capture is not None:
+        _capture_step()
+    if ENABLED and report_every and _steps % report_every == 0:
+        print(report())
+
+
+def report(reset=True):
+    # Steps/sec and the share of wall time, mean, p50 and p99 of every phase since the last report
+    global _window_start, _window_steps
+    now = time.perf_counter()
+    wall = now - _window_start
+    lines = [f'Profile: {_steps} steps, {(_steps - _window_steps) / wall:.0f} steps/sec']
+    for name in sorted(_spans):
+        s = _spans[name]
+        if not s.count:
+            continue
+        lines.append(f'  {name:<24} {100 * s.total / 1e9 / wall:5.1f}%  mean {s.total / s.count / 1e3:8.1f} us'
+                     f'  p50 <{s.percentile(50) / 1e3:8.1f} us  p99 <{s.percentile(99) / 1e3:8.1f} us  n={s.count}')
+    if reset:
+        for s in _spans.values():
+            s.reset()
+        _window_start = now
+        _window_steps = _steps
+    return '\n'.join(lines)
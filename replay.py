@@ -0,0 +1,239 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+# Buffer columns written by ReplayBuffer.save, one .npy file each
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'dones', 'next_masks')
+
+
+def _save_array(path, array):
+    # np.save + fsync so a finished checkpoint survives a crash
+    with open(path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ReplayBuffer:
+    """
+    Fixed capacity replay memory stored in preallocated tensors.
+
+    Inserting overwrites the oldest transition once full (same as a deque with maxlen),
+    sampling indexes the storage directly so a batch comes out as ready tensors.
+    """
+
+    # state_shape is the state length (or shape, e.g. grid planes), state_dtype lets grids be stored as uint8
+    # num_actions sizes the stored legal-move masks (4 moves, or 4 pushes per block for macro actions)
+    def __init__(self, capacity, state_shape, device='cpu', state_dtype=torch.float, num_actions=4):
+        self.capacity = capacity
+        self.device = torch.device(device)
+        state_shape = (state_shape,) if isinstance(state_shape, int) else tuple(state_shape)
+        self.states = torch.zeros((capacity, *state_shape), dtype=state_dtype)
+        self.actions = torch.zeros(capacity, dtype=torch.long)
+        self.rewards = torch.zeros(capacity, dtype=torch.float)
+        self.next_states = torch.zeros((capacity, *state_shape), dtype=state_dtype)
+        self.dones = torch.zeros(capacity, dtype=torch.bool)
+        # Legal moves in next_state, all True when the caller doesn't mask actions
+        self.next_masks = torch.ones((capacity, num_actions), dtype=torch.bool)
+
+        # Next slot to write and number of filled slots
+        self.pos = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, state, action, reward, next_state, done, next_mask=None):
+        # action is the index of the move made, next_mask the (num_actions,) legal moves in next_state
+        i = self.pos
+        self.states[i] = torch.as_tensor(state, dtype=self.states.dtype)
+        self.actions[i] = int(action)
+        self.rewards[i] = float(reward)
+        self.next_states[i] = torch.as_tensor(next_state, dtype=self.states.dtype)
+        self.dones[i] = bool(done)
+        self.next_masks[i] = True if next_mask is None else torch.as_tensor(np.asarray(next_mask), dtype=torch.bool)
+
+        self.pos = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_batch(self, states, actions, rewards, next_states, dones, next_masks=None):
+        # Inserts N transitions at once, arrays have a leading batch axis
+        n = len(states)
+        idx = (self.pos + np.arange(n)) % self.capacity
+        idx = torch.from_numpy(idx)
+        self.states[idx] = torch.as_tensor(np.asarray(states), dtype=self.states.dtype)
+        self.actions[idx] = torch.as_tensor(np.asarray(actions), dtype=torch.long)
+        self.rewards[idx] = torch.as_tensor(np.asarray(rewards), dtype=torch.float)
+        self.next_states[idx] = torch.as_tensor(np.asarray(next_states), dtype=self.states.dtype)
+        self.dones[idx] = torch.as_tensor(np.asarray(dones), dtype=torch.bool)
+        self.next_masks[idx] = True if next_masks is None else torch.as_tensor(np.asarray(next_masks), dtype=torch.bool)
+
+        self.pos = (self.pos + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def _gather(self, idx):
+        states, actions, rewards, next_states, dones, next_masks = (
+            t[idx].to(self.device, non_blocking=True)
+            for t in (self.states, self.actions, self.rewards, self.next_states, self.dones, self.next_masks))
+        return states.float(), actions, rewards, next_states.float(), dones, next_masks
+
+    def snapshot(self):
+        # Copy of the filled part of the memory as numpy arrays, cheap enough to take on the training thread
+        arrays = {name: getattr(self, name)[:self.size].numpy().copy() for name in COLUMNS}
+        return arrays, {'pos': self.pos, 'size': self.size}
+
+    @staticmethod
+    def write_snapshot(directory, snapshot):
+        # Writes a snapshot() as raw .npy files plus meta.json, no pickling
+        arrays, meta = snapshot
+        os.makedirs(directory, exist_ok=True)
+        for name, array in arrays.items():
+            _save_array(os.path.join(directory, name + '.npy'), array)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, directory):
+        self.write_snapshot(directory, self.snapshot())
+
+    def load(self, directory):
+        # Reads a saved memory back, the arrays are memory mapped and copied straight into the storage
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        size = meta['size']
+        if size > self.capacity:
+            raise ValueError(f'Saved memory holds {size} transitions, capacity is {self.capacity}')
+
+        for name in COLUMNS:
+            path = os.path.join(directory, name + '.npy')
+            if name == 'next_masks' and not os.path.exists(path):
+                # saved before masks were stored
+                self.next_masks[:size] = True
+                continue
+            array = np.load(path, mmap_mode='r')
+            storage = getattr(self, name)
+            if array.shape[1:] != tuple(storage.shape[1:]):
+                raise ValueError(f'Saved {name} have shape {array.shape[1:]}, expected {tuple(storage.shape[1:])}')
+            storage[:size].numpy()[:] = array
+        self.size = size
+        self.pos = meta['pos'] % self.capacity
+        return meta
+
+    def sample(self, batch_size):
+        # Returns (states, actions, rewards, next_states, dones, next_masks) tensors, the whole memory if it is smaller than batch_size
+        if self.size > batch_size:
+            idx = torch.randint(0, self.size, (batch_size,))
+        else:
+            idx = torch.arange(self.size)
+        return self._gather(idx)
+
+
+class SumTree:
+    """
+    Binary tree over `capacity` priorities where each node holds the sum of its children.
+
+    Leaf i is stored at tree[leaves + i] and the root at tree[1], so proportional sampling and
+    priority updates are O(log n). Both work on whole batches of indices at once.
+    """
+
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[self.leaves + np.asarray(idx)]
+
+    def update(self, idx, priorities):
+        node = self.leaves + np.asarray(idx)
+        self.tree[node] = priorities
+
+        # Recompute parents level by level, duplicate indices in a batch just recompute the same node
+        for _ in range(self.depth):
+            node = np.unique(node // 2)
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+
+    def find(self, values):
+        # Leaf index for every value in [0, total), walking down from the root
+        node = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=float)
+        for _ in range(self.depth):
+            left = 2 * node
+            left_sum = self.tree[left]
+            go_right = values > left_sum
+            values = np.where(go_right, values - left_sum, values)
+            node = np.where(go_right, left + 1, left)
+        return node - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer that samples transitions in proportion to priority ** alpha.
+
+    New transitions get the highest priority seen so far, update_priorities sets them from the
+    TD errors of the last update. sample also returns importance-sampling weights, annealed from
+    beta up to 1 over beta_steps samples, and the indices to pass back to update_priorities.
+    """
+
+    def __init__(self, capacity, state_shape, device='cpu', state_dtype=torch.float, num_actions=4,
+                 alpha=0.6, beta=0.4, beta_steps=100_000, eps=1e-3):
+        super().__init__(capacity, state_shape, device, state_dtype, num_actions)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / beta_steps
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def push(self, state, action, reward, next_state, done, next_mask=None):
+        i = self.pos
+        super().push(state, action, reward, next_state, done, next_mask)
+        self.tree.update([i], self.max_priority ** self.alpha)
+
+    def push_batch(self, states, actions, rewards, next_states, dones, next_masks=None):
+        idx = (self.pos + np.arange(len(states))) % self.capacity
+        super().push_batch(states, actions, rewards, next_states, dones, next_masks)
+        self.tree.update(idx, self.max_priority ** self.alpha)
+
+    def sample(self, batch_size):
+        # Returns (states, actions, rewards, next_states, dones, next_masks, weights, idx)
+        # Stratified: one value from each of batch_size equal slices of the total priority
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        idx = np.minimum(self.tree.find(values), self.size - 1)
+
+        # Importance-sampling weights, normalised so the largest is 1
+        probs = self.tree.get(idx) / total
+        weights = (self.size * probs) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        weights = torch.as_tensor(weights, dtype=torch.float).to(self.device, non_blocking=True)
+        return self._gather(torch.from_numpy(idx)) + (weights, idx)
+
+    def snapshot(self):
+        arrays, meta = super().snapshot()
+        arrays['priorities'] = self.tree.get(np.arange(self.size))
+        meta.update(beta=self.beta, max_priority=self.max_priority)
+        return arrays, meta
+
+    def load(self, directory):
+        meta = super().load(directory)
+        priorities = np.load(os.path.join(directory, 'priorities.npy'), mmap_mode='r')
+        self.tree.update(np.arange(self.size), priorities)
+        self.beta = meta['beta']
+        self.max_priority = meta['max_priority']
+        return meta
+
+    def update_priorities(self, idx, td_errors):
+        priorities = np.abs(np.asarray(td_errors, dtype=float)) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(idx, priorities ** self.alpha)
@@ -0,0 +1,130 @@
+import copy
+import queue
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from agent import masked_choice
+from sokobanvec import VectorSokoban
+
+# Steps an actor takes between checks for new learner weights
+SYNC_EVERY = 100
+
+
+def actor_worker(worker_id, w, h, num_objects, num_envs, shared_model, version, epsilon,
+                 transitions, stop, seed, level_pool=None, grid_size=None, mask_actions=False):
+    """
+    Actor process: steps its own VectorSokoban with a local copy of the learner's network
+    and streams (states, actions, rewards, next_states, dones, wins, moves, next_masks) batches back to the learner.
+
+    The local copy is refreshed from shared_model every SYNC_EVERY steps if the learner has bumped version.
+    States are grid planes of side grid_size if it is set (conv model), the feature list otherwise.
+    With mask_actions only legal moves are played and next_masks holds the legal moves of next_states (None otherwise).
+    """
+    # One core per actor, the learner gets the rest
+    torch.set_num_threads(1)
+    np.random.seed(seed)
+
+    env = VectorSokoban(num_envs, w, h, num_objects, level_pool)
+    model = copy.deepcopy(shared_model)
+    local_version = -1
+
+    def get_states():
+        return env.get_grid_state(grid_size) if grid_size else env.get_state()
+
+    cur_moves = np.zeros(num_envs, dtype=int)
+    states = get_states()
+    masks = env.can_move() if mask_actions else None
+    steps = 0
+    while not stop.is_set():
+        if steps % SYNC_EVERY == 0 and version.value != local_version:
+            with version.get_lock():
+                model.load_state_dict(shared_model.state_dict())
+                local_version = version.value
+
+        # Epsilon-greedy with the exploration rate owned by the learner
+        with torch.no_grad():
+            q = model(torch.tensor(states, dtype=torch.float)).numpy()
+        explore = np.random.random(num_envs) < epsilon.value
+        if mask_actions:
+            actions = masked_choice(q, masks, explore)
+        else:
+            actions = q.argmax(axis=1)
+            actions[explore] = np.random.randint(0, 4, explore.sum())
+
+        rewards, dones, wins = env.play_step(actions)
+        next_states = get_states()
+        next_masks = env.can_move() if mask_actions else None
+        cur_moves += 1
+
+        transitions.put((worker_id, states, actions, rewards, next_states, dones, wins, cur_moves.copy(), next_masks))
+
+        cur_moves[dones] = 0
+        states = next_states
+        masks = next_masks
+        steps += 1
+
+
+class RolloutPool:
+    """
+    Pool of actor processes feeding one learner.
+
+    The learner owns the replay memory and the trainer, it calls publish() after updating its model
+    and collect() to get the transitions the actors produced since the last call.
+    level_pool is a path to a levelgen pool or levelset collection file, each actor memory maps its own copy.
+    grid_size is the agent's board_size when it uses the conv model, mask_actions makes actors play legal moves only.
+    """
+
+    def __init__(self, model, w=9, h=9, num_objects=1, num_workers=4, envs_per_worker=8, epsilon=1.0,
+                 level_pool=None, grid_size=None, mask_actions=False):
+        ctx = mp.get_context('spawn')
+
+        # CPU copy of the learner's network in shared memory, actors copy from it
+        self.shared_model = copy.deepcopy(model).cpu()
+        self.shared_model.share_memory()
+        self.version = ctx.Value('i', 0)
+        self.epsilon = ctx.Value('d', epsilon)
+        self.transitions = ctx.Queue(maxsize=num_workers * 16)
+        self.stop = ctx.Event()
+        self.publish(model)
+
+        self.workers = [
+            ctx.Process(target=actor_worker, daemon=True,
+                        args=(i, w, h, num_objects, envs_per_worker, self.shared_model, self.version,
+                              self.epsilon, self.transitions, self.stop, np.random.randint(2 ** 31), level_pool, grid_size,
+                              mask_actions))
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def publish(self, model):
+        # Copies the learner's weights into shared memory, actors pick them up on their next sync
+        with self.version.get_lock():
+            with torch.no_grad():
+                for shared, param in zip(self.shared_model.state_dict().values(), model.state_dict().values()):
+                    shared.copy_(param.detach().cpu())
+            self.version.value += 1
+
+    def set_epsilon(self, epsilon):
+        self.epsilon.value = epsilon
+
+    def collect(self, timeout=1.0):
+        # Blocks for the first batch then drains whatever else is waiting
+        batches = []
+        try:
+            batches.append(self.transitions.get(timeout=timeout))
+            while True:
+                batches.append(self.transitions.get_nowait())
+        except queue.Empty:
+            pass
+        return batches
+
+    def close(self):
+        self.stop.set()
+        # Unblock actors waiting on a full queue so they can see the stop event
+        while any(worker.is_alive() for worker in self.workers):
+            self.collect(timeout=0.1)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,179 @@
+import json
+import queue
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+from cache import StateCache
+from model import load_model, ConvQNet
+from sokobanbot import Sokoban
+
+MOVE_NAMES = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+
+
+def export(model, example, path, fmt='torchscript'):
+    # Writes a TorchScript (.pt) or ONNX (.onnx) copy of model, example is one batched input
+    model.eval()
+    if fmt == 'torchscript':
+        with torch.inference_mode():
+            traced = torch.jit.trace(model, example)
+        traced.save(path)
+    elif fmt == 'onnx':
+        # needs the onnx package
+        torch.onnx.export(model, example, path, input_names=['state'], output_names=['q'],
+                          dynamic_axes={'state': {0: 'batch'}, 'q': {0: 'batch'}})
+    else:
+        raise ValueError(f'Unknown export format {fmt}')
+
+
+class PolicyServer:
+    """
+    Answers move requests with the greedy action of a trained policy, on the CPU.
+
+    Requests from any number of threads are queued and a single worker thread runs them through the
+    network together: it waits up to max_wait_ms after the first request for more to arrive (up to
+    max_batch) so concurrent sessions share one forward pass. With cache_size set, answers for states
+    already seen are returned straight from an LRU cache (the weights never change while serving).
+    """
+
+    def __init__(self, model, max_batch=64, max_wait_ms=2.0, threads=None, cache_size=None):
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = model
+        self.board_size = model.board_size if isinstance(model, ConvQNet) else None
+        # Shape of one state, requests are checked against it so a bad one can't fail the batch it lands in
+        if self.board_size:
+            self.state_shape = (model.conv1.in_channels, self.board_size, self.board_size)
+        else:
+            self.state_shape = (model.linear1.in_features,)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.cache = StateCache(cache_size) if cache_size else None
+        self.cache_lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def encode(self, level):
+        # State for a level given as a uint8 grid of sokobanbot WALL / HOLE / BLOCK / PLAYER flags
+        game = Sokoban.from_grid(level)
+        if self.board_size:
+            return game.grid_state(self.board_size)
+        return game.feature_state()
+
+    def submit(self, state):
+        # Returns a Future resolving to (action index, q values), raises ValueError for a state of the wrong shape
+        state = np.asarray(state, dtype=np.float32)
+        if state.shape != self.state_shape:
+            raise ValueError(f'State has shape {state.shape}, the model takes {self.state_shape}')
+        future = Future()
+        if self.cache:
+            with self.cache_lock:
+                q = self.cache.q.get(state.tobytes())
+            if q is not None:
+                future.set_result((int(np.argmax(q)), q))
+                return future
+        self.requests.put((state, future))
+        return future
+
+    def predict(self, state, timeout=None):
+        return self.submit(state).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self.requests.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+
+            try:
+                states = torch.from_numpy(np.stack([state for state, _ in batch]))
+                with torch.inference_mode():
+                    q = self.model(states)
+                actions = q.argmax(dim=1).tolist()
+                q = q.tolist()
+                for i, (state, future) in enumerate(batch):
+                    if self.cache:
+                        with self.cache_lock:
+                            self.cache.q.put(state.tobytes(), q[i])
+                    future.set_result((actions[i], q[i]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class MoveServer(ThreadingHTTPServer):
+    # default listen backlog of 5 drops connections from bursts of concurrent sessions
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_handler(server):
+    class MoveHandler(BaseHTTPRequestHandler):
+        # POST /move with {"state": [...]} (already encoded) or {"level": [[...], ...]} (flag grid)
+        def do_POST(self):
+            if self.path != '/move':
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                state = body['state'] if 'state' in body else server.encode(body['level'])
+                action, q = server.predict(state, timeout=5)
+                # push models have 4 actions per block, action = block * 4 + direction
+                reply = {'action': action, 'move': MOVE_NAMES[action % 4], 'q': q}
+                if len(q) > 4:
+                    reply['block'] = action // 4
+                code = 200
+            except Exception as e:
+                reply = {'error': str(e)}
+                code = 400
+
+            data = json.dumps(reply).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MoveHandler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve moves from a trained model over HTTP')
+    parser.add_argument('--model', default='./model/model.pth')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--cache-size', type=int, default=100_000, help='states to keep answers for, 0 = off')
+    parser.add_argument('--export', choices=['torchscript', 'onnx'], default=None,
+                        help='write an exported copy of the model next to it before serving')
+    parser.add_argument('--use-export', action='store_true', help='serve the TorchScript export instead of eager')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    policy = PolicyServer(model, args.max_batch, args.max_wait_ms, args.threads, args.cache_size)
+
+    if args.export:
+        example = torch.zeros((1, *policy.state_shape))
+        path = args.model.rsplit('.', 1)[0] + ('.pt' if args.export == 'torchscript' else '.onnx')
+        export(model, example, path, args.export)
+        print(f'Exported {path}')
+        if args.use_export and args.export == 'torchscript':
+            policy.model = torch.jit.load(path)
+
+    httpd = MoveServer((args.host, args.port), make_handler(policy))
+    print(f'Serving on http://{args.host}:{args.port}/move')
+    httpd.serve_forever()
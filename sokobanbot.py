@@ -1,16 +1,11 @@
-import pygame
+import math
 import random
 from enum import Enum
-from collections import namedtuple
+from collections import namedtuple, deque
 import numpy as np
 
-import time
-
-
-# Initialize pygame modules
-pygame.init()
-
-font = pygame.font.Font('arial.ttf', 25)
+import deadlock
+import profiling
 
 # Enum for player movement directions
 class Direction(Enum):
@@ -20,150 +15,286 @@ class Direction(Enum):
     DOWN = 4
 
 
-# Point structure to store x and y coordinates
+# Point structure to store x and y coordinates (in cells)
 Point = namedtuple('Point', 'x, y')
 
-# RGB color definitions
-WHITE = (255, 255, 255)
-RED = (200, 0, 0)
-BLUE = (0, 0, 255)
-GREEN = (0, 255, 0)
-BLACK = (0, 0, 0)
-CYAN = (0, 255, 255)
-PINK = (255, 0, 255)
+# Action index order used by the agent: [up, down, left, right]
+ACTIONS = [Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT]
+
+# (dx, dy) for each direction
+DELTAS = {
+    Direction.UP: (0, -1),
+    Direction.DOWN: (0, 1),
+    Direction.LEFT: (-1, 0),
+    Direction.RIGHT: (1, 0),
+}
+
+# Marks an empty cell in block_grid
+NO_BLOCK = -1
 
-# Size of each player block
-BLOCK_SIZE = 80
+# Cell flags used when a whole level is stored as one uint8 grid (see level_grid / load_level)
+WALL = 1
+HOLE = 2
+BLOCK = 4
+PLAYER = 8
 
 class Sokoban:
-    def __init__(self, w=720, h=720):
-        # Screen width and height
+    # Pure game logic, pygame is only imported when a renderer is attached (render=True)
+    # level_pool: a levelgen.LevelPool or levelset.LevelCollection (or path to either) that reset draws levels from
+    # instead of placing them randomly, only its levels with num_objects blocks that fit in w x h are used
+    # grid: start on this level grid instead of a random one (see from_grid)
+    def __init__(self, w=9, h=9, num_objects=1, render=False, debug_mode=False, level_pool=None, grid=None):
+        # Board width and height in cells
         self.w = w
         self.h = h
+        self.num_objects = num_objects
+        self.debug_mode = debug_mode
+        self.moves_made = 0
         self.player = None
-        self.blocks = None
-        self.holes = None
         self.in_hole = 0
-        self.paths = None
         self.tot_block_ct = 0
 
-        # Initialize game window
-        self.display = pygame.display.set_mode((self.w, self.h))
-        pygame.display.set_caption('Sokoban')
-
-        self.reset()
+        # Occupancy grids, indexed [y, x]
+        # walls: True where the player and blocks can't go
+        # hole_grid: True where there is a hole
+        # block_grid: index into self.blocks of the block on that cell, NO_BLOCK if empty
+        self.walls = np.zeros((h, w), dtype=bool)
+        self.hole_grid = np.zeros((h, w), dtype=bool)
+        self.block_grid = np.full((h, w), NO_BLOCK, dtype=np.int16)
+
+        # (x, y) of every block / hole, row i of blocks is the block with id i in block_grid
+        self.blocks = np.zeros((num_objects, 2), dtype=np.int64)
+        self.holes = np.zeros((num_objects, 2), dtype=np.int64)
+
+        # distances[j, y, x] is the fewest pushes to get a block from (x, y) onto hole j (inf if it can't be done)
+        self.distances = np.zeros((num_objects, h, w))
+        # The same table as nested lists, cell_distances[y][x] is the list of distances to every hole, and the
+        # holes as (x, y) ints, so push_reward is a few plain Python lookups instead of numpy calls
+        self.cell_distances = self.distances.transpose(1, 2, 0).tolist()
+        self.hole_cells = []
+        self.wall_key = b''
+
+        # Cells a block can never be pushed from onto a hole, computed once per level in reset
+        self.dead_squares = np.zeros((h, w), dtype=bool)
+        self.dead_on_arrival = False
+
+        self.level_pool = None
+        self.level_id = None
+        if level_pool is not None:
+            from levelset import open_levels
+            self.level_pool = open_levels(level_pool) if isinstance(level_pool, str) else level_pool
+            # ids of the levels this board can play, smaller levels are walled in at the top left
+            lw, lh, blocks = self.level_pool.sizes.T
+            self.level_ids = np.flatnonzero((lw <= w) & (lh <= h) & (blocks == num_objects))
+            if not len(self.level_ids):
+                raise ValueError(f'No level in the pool fits a {w}x{h} board with {num_objects} blocks')
+
+        # Only open a window when asked to, training on headless machines never touches pygame
+        self.renderer = None
+        if render:
+            from sokobanrender import SokobanRenderer
+            self.renderer = SokobanRenderer(self)
+
+        self.reset(grid=grid)
+
+    @classmethod
+    def from_grid(cls, grid, render=False, debug_mode=False):
+        # Game sized to and loaded with a uint8 WALL / HOLE / BLOCK / PLAYER grid, no random level is made first
+        grid = np.asarray(grid, dtype=np.uint8)
+        if grid.ndim != 2 or not grid.size:
+            raise ValueError(f'Level grid has shape {grid.shape}, expected (h, w)')
+        if ((grid & PLAYER) != 0).sum() != 1:
+            raise ValueError('Level grid needs exactly one player')
+        if ((grid & BLOCK) != 0).sum() != ((grid & HOLE) != 0).sum():
+            raise ValueError('Level grid needs as many holes as blocks')
+        h, w = grid.shape
+        return cls(w, h, int(((grid & BLOCK) != 0).sum()), render, debug_mode, grid=grid)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.w and 0 <= y < self.h
+
+    def is_free(self, x, y):
+        # True if a block could be moved onto this cell
+        return self.in_bounds(x, y) and not self.walls[y, x] and self.block_grid[y, x] == NO_BLOCK
 
     def paired(self, point):
-        return point in self.block_hole_pairs
+        # True if a block sits on a hole at this point
+        return self.hole_grid[point.y, point.x] and self.block_grid[point.y, point.x] != NO_BLOCK
 
-    def reset(self):
-        x_p = random.randint(0, 8) * BLOCK_SIZE
-        y_p = random.randint(0, 8) * BLOCK_SIZE
+    def reset(self, level_id=None, grid=None):
+        # Draws level_id (or a random level) from the level pool if there is one, otherwise places everything randomly
+        # grid: play this level grid (see load_level) instead
         self.moves_made = 0
+        if grid is not None:
+            self.level_id = None
+            self.load_level(grid)
+        elif self.level_pool is not None:
+            if level_id is None:
+                level_id = int(self.level_ids[random.randrange(len(self.level_ids))])
+            self.level_id = level_id
+            self.load_level(self.level_pool[level_id])
+        else:
+            self._random_level()
+
+        self._analyse_level()
+
+    def _random_level(self):
+        x_p = random.randint(0, self.w - 1)
+        y_p = random.randint(0, self.h - 1)
         self.player = Point(x_p, y_p)
         self.in_hole = 0
-        self.blocks = []
-        self.holes = []
-        self.paths = dict()
+        self.walls[:] = False
+        self.hole_grid[:] = False
+        self.block_grid[:] = NO_BLOCK
 
-        while len(self.blocks) < 1:
-            x = random.randint(0, 7) * BLOCK_SIZE
-            y = random.randint(0, 7) * BLOCK_SIZE
+        placed = 0
+        while placed < self.num_objects:
+            x = random.randint(0, self.w - 2)
+            y = random.randint(0, self.h - 2)
 
-            if Point(x, y) != self.player:
-                self.blocks.append(Point(x, y))
+            if Point(x, y) != self.player and self.block_grid[y, x] == NO_BLOCK:
+                self.blocks[placed] = (x, y)
+                self.block_grid[y, x] = placed
+                placed += 1
 
         self.tot_block_ct = len(self.blocks)
 
-        while len(self.holes) < 1:
-            x = random.randint(0, 8) * BLOCK_SIZE
-            y = random.randint(0, 8) * BLOCK_SIZE
-
-            if Point(x, y) != self.player and Point(x, y) not in self.blocks:
-                self.holes.append(Point(x, y))
-
-        for block in self.blocks:
-            self.paths[block] = dict()
-
-            for hole in self.holes:
-                self.paths[block][hole] = abs(block.x - hole.x) / BLOCK_SIZE + abs(block.y - hole.y) / BLOCK_SIZE
-
-    def update_paths(self, old_pos, new_pos):
-
-        self.paths[new_pos] = dict()
-
-        closest_dist_reached, longest_dist_reached = None, None
-        # if none of the above conditions are true, then we will proceed with the dynamic reward system
+        placed = 0
+        while placed < self.num_objects:
+            x = random.randint(0, self.w - 1)
+            y = random.randint(0, self.h - 1)
+
+            if Point(x, y) != self.player and self.block_grid[y, x] == NO_BLOCK and not self.hole_grid[y, x]:
+                self.holes[placed] = (x, y)
+                self.hole_grid[y, x] = True
+                placed += 1
+
+    def load_level(self, grid):
+        # Sets the board from a uint8 grid of WALL / HOLE / BLOCK / PLAYER flags, blocks are numbered in row order
+        # A grid smaller than the board is placed at the top left and the rest is wall
+        grid = np.asarray(grid)
+        if grid.shape != (self.h, self.w):
+            padded = np.full((self.h, self.w), WALL, dtype=np.uint8)
+            padded[:grid.shape[0], :grid.shape[1]] = grid
+            grid = padded
+        self.walls[:] = (grid & WALL) != 0
+        self.hole_grid[:] = (grid & HOLE) != 0
+        self.block_grid[:] = NO_BLOCK
+
+        by, bx = np.nonzero(grid & BLOCK)
+        self.blocks[:] = np.stack([bx, by], axis=1)
+        self.block_grid[by, bx] = np.arange(len(bx))
+        hy, hx = np.nonzero(self.hole_grid)
+        self.holes[:] = np.stack([hx, hy], axis=1)
+
+        py, px = np.nonzero(grid & PLAYER)
+        self.player = Point(int(px[0]), int(py[0]))
+        self.in_hole = int(self.hole_grid[by, bx].sum())
+        self.tot_block_ct = len(self.blocks)
 
-        for hole in self.holes:
+    def level_grid(self):
+        # The current board as a uint8 grid of WALL / HOLE / BLOCK / PLAYER flags
+        grid = np.zeros((self.h, self.w), dtype=np.uint8)
+        grid[self.walls] |= WALL
+        grid[self.hole_grid] |= HOLE
+        grid[self.block_grid != NO_BLOCK] |= BLOCK
+        grid[self.player.y, self.player.x] |= PLAYER
+        return grid
+
+    def _analyse_level(self):
+        # Push distance fields, the reward for every push after this is a lookup
+        self.distances = deadlock.push_distances(self.walls, self.holes)
+        self.cell_distances = self.distances.transpose(1, 2, 0).tolist()
+        self.hole_cells = [(int(x), int(y)) for x, y in self.holes]
+        # Identifies the level's walls, part of cache.StateCache's mask keys since the feature list leaves them out
+        self.wall_key = self.walls.tobytes()
+        # a block can't reach any hole from a dead square
+        self.dead_squares = ~self.walls & np.isinf(self.distances).all(axis=0)
+        # Full check once, after that only the pushed block is checked each step
+        self.dead_on_arrival = self.immovable_block_detect()
+
+    def push_reward(self, old_pos, new_pos):
+        block_grid = self.block_grid
+        block = block_grid[new_pos.y, new_pos.x]
+
+        old_dist = self.cell_distances[old_pos.y][old_pos.x]
+        new_dist = self.cell_distances[new_pos.y][new_pos.x]
+
+        """
+        A small multiplier of 1.5 is applied to pos rewards as equal neg/pos rewards in magnitude generally didn't work
+        The '7' denotes the farthest a block can be from a hole in stepping distance
+        Keep a constant negative reward of -1 as the block moves away from the hole
+        The negative reward of -1 simply based off the conditions in old/new distances creates a conflict when dealing with multiple blocks/holes
+        If a block is close to a hole but the tot reward is net negative due to a large amt of holes, it may create redundancy
+        """
+        closest = math.inf  # nearest usable hole the block got closer to
+        farthest = None  # farthest usable hole
+        for j, (hx, hy) in enumerate(self.hole_cells):
+            # holes filled by another block and holes this block can no longer reach don't count
+            dist = new_dist[j]
+            if dist == math.inf:
+                continue
+            hole_block = block_grid[hy, hx]
+            if hole_block != NO_BLOCK and hole_block != block:
+                continue
+            if dist == 0:
+                return 50
+            if dist < old_dist[j] and dist < closest:
+                closest = dist
+            if farthest is None or dist > farthest:
+                farthest = dist
 
-            old_dist = self.paths[old_pos][hole]
-            new_dist = abs(new_pos.x - hole.x) / BLOCK_SIZE + abs(new_pos.y - hole.y) / BLOCK_SIZE
+        if closest != math.inf:
+            # a closer distance has been acheived
+            return 5 / min(7, closest)
 
-            self.paths[new_pos][hole] = new_dist
-            """
-            A small multiplier of 1.5 is applied to pos rewards as equal neg/pos rewards in magnitude generally didn't work
-            The '7' denotes the farthest a block can be from a hole in stepping distance
-            Keep a constant negative reward of -1 as the block moves away from the hole
-            The negative reward of -1 simply based off the conditions in old/new distances creates a conflict when dealing with multiple blocks/holes
-            If a block is close to a hole but the tot reward is net negative due to a large amt of holes, it may create redundancy
-            """
+        return max(1, farthest) if farthest is not None else 1
 
-            if new_dist == 0:
-                return 50
+    def on_border(self, point):
+        return point.x in (0, self.w - 1) or point.y in (0, self.h - 1)
 
-            if new_dist < old_dist:
-                # a closer distance has been acheived
-                closest_dist_reached = min(7 if not closest_dist_reached else closest_dist_reached, new_dist)
-            else:
-                longest_dist_reached = max(1 if not longest_dist_reached else longest_dist_reached, new_dist)
+    def immovable_block_detect(self, old_pos=None, new_pos=None):
+        # With the old / new position of a pushed block only that block is checked, otherwise every block is
 
-        # delete the old block's positions
-        del self.paths[old_pos]
+        if new_pos is None:
+            if deadlock.any_block_deadlocked(self.walls, self.dead_squares, self.block_grid, self.hole_grid, self.blocks):
+                return True
+        elif deadlock.block_deadlocked(self.walls, self.dead_squares, self.block_grid, self.hole_grid, new_pos.x, new_pos.y):
+            return True
+        # blocks on a border stay on it, so the counts below only change when a block moves along one
+        elif not (self.on_border(old_pos) or self.on_border(new_pos)):
+            return False
 
-        return 5/closest_dist_reached if closest_dist_reached else longest_dist_reached
+        return self.border_count_deadlock()
 
-    def immovable_block_detect(self):
-        # create a dict denoting the number of blocks / holes in each border
+    def border_count_deadlock(self):
+        # number of blocks / holes in each border
         block_ct_borders = [0, 0, 0, 0] # UP, DOWN, LEFT, RIGHT
         hole_ct_borders = [0, 0, 0, 0] # UP, DOWN, LEFT, RIGHT
 
-        for block in self.blocks:
-            # hole in occupied
-            if block in self.holes:
-                continue
-            if block in (Point(0, 0),
-                         Point(self.w - BLOCK_SIZE, 0),
-                         Point(0, self.h - BLOCK_SIZE),
-                         Point(self.w - BLOCK_SIZE, self.h - BLOCK_SIZE)):
-                return True
-
-            # border presence check
-            if block.x == 0:
-                block_ct_borders[2] += 1
-            elif block.x == self.w - BLOCK_SIZE:
-                block_ct_borders[3] += 1
-            elif block.y == 0:
-                block_ct_borders[0] += 1
-            elif block.y == self.h - BLOCK_SIZE:
-                block_ct_borders[1] += 1
-
-            # if the block is within the top, bottom, left, or right borders where an unoccupied hole is not available on the same border, the game must end
-
-        # get the border count for each hole
-        for hole in self.holes:
-            # hole is occupied
-            if hole in self.blocks:
-                continue
-
-            if hole.x == 0:
-                hole_ct_borders[2] += 1
-            elif hole.x == self.w - BLOCK_SIZE:
-                hole_ct_borders[3] += 1
-            elif hole.y == 0:
-                hole_ct_borders[0] += 1
-            elif hole.y == self.h - BLOCK_SIZE:
-                hole_ct_borders[1] += 1
+        # blocks not sitting on a hole
+        bx, by = self.blocks[:, 0], self.blocks[:, 1]
+        loose = ~self.hole_grid[by, bx]
+        bx, by = bx[loose], by[loose]
+
+        # free holes
+        hx, hy = self.holes[:, 0], self.holes[:, 1]
+        free = self.block_grid[hy, hx] == NO_BLOCK
+        hx, hy = hx[free], hy[free]
+
+        # border presence check
+        # if the block is within the top, bottom, left, or right borders where an unoccupied hole is not available on the same border, the game must end
+        # a hole in a corner is on two borders and counts for both
+        for counts, xs, ys in ((block_ct_borders, bx, by), (hole_ct_borders, hx, hy)):
+            left = xs == 0
+            right = xs == self.w - 1
+            up = ys == 0
+            down = ys == self.h - 1
+            if counts is block_ct_borders:
+                right &= ~left
+                up &= ~left & ~right
+                down &= ~left & ~right & ~up
+            counts[0], counts[1], counts[2], counts[3] = up.sum(), down.sum(), left.sum(), right.sum()
 
         # compare arrays -> if the # of holes in each border >= corresponding index in hole_ct_borders, there is still a way to win
         for i in range(0, len(block_ct_borders)):
@@ -173,18 +304,13 @@ class Sokoban:
         return False
 
     def play_step(self, action):
-        # TODO: return respective vars: reward, game_over, game_win
-
-        # Handle user input
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+        # Handle user input (only when a window is open)
+        if self.renderer:
+            self.renderer.handle_events()
 
         # action is [up, down, left, right]
         if isinstance(action, (list, tuple, np.ndarray)):
-            idx = int(np.argmax(action))
-            action = [Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT][idx]
+            action = ACTIONS[int(np.argmax(action))]
 
         self.moves_made += 1
 
@@ -195,189 +321,224 @@ class Sokoban:
         reward = -0.1
 
         # get old player states
-        old_x, old_y = self.player.x, self.player.y
+        old_player = self.player
 
         # execute move from agent action
-        old_pushed_block_pos, new_pushed_block_pos = self._move(action)
+        with profiling.span('play_step.move'):
+            old_pushed_block_pos, new_pushed_block_pos = self._move(action)
 
         if old_pushed_block_pos and new_pushed_block_pos:
-            reward += self.update_paths(old_pushed_block_pos, new_pushed_block_pos)
+            with profiling.span('play_step.push_reward'):
+                reward += self.push_reward(old_pushed_block_pos, new_pushed_block_pos)
 
-        elif old_x == self.player.x and old_y == self.player.y:
+        elif old_player == self.player:
             reward -= 5
 
         # check if agent completed the game
         if self.in_hole == len(self.holes):
             reward += 300
             game_over = True
+            self._debug(reward, game_over, True)
             return reward, game_over, True
 
         # check if agent moved a block into an immovable state
-        if self.immovable_block_detect() or self.moves_made > 1600:
+        with profiling.span('play_step.deadlock'):
+            dead = self.dead_on_arrival or self.moves_made > 1600 or (
+                new_pushed_block_pos and self.immovable_block_detect(old_pushed_block_pos, new_pushed_block_pos))
+        if dead:
             reward -= 5
             game_over = True
+            self._debug(reward, game_over, False)
             return reward, game_over, False
 
-        self._update_ui()
+        if self.renderer:
+            with profiling.span('play_step.update_ui'):
+                self._update_ui()
 
+        self._debug(reward, game_over, False)
         # return
         return reward, game_over, False
 
-    # Moves the player, Returns True if a block is moved too
+    def _debug(self, reward, game_over, game_win):
+        if self.debug_mode:
+            print(f'Move: {self.moves_made}, Reward: {reward}, Game over: {game_over}, Win: {game_win}')
+
+    # Moves the player, returns the old and new position of the pushed block (None, None if no block is pushed)
     def _move(self, direction):
-        x = self.player.x
-        y = self.player.y
+        if not self.can_move(direction):
+            return None, None
+
+        dx, dy = DELTAS[direction]
+        x = self.player.x + dx
+        y = self.player.y + dy
         old_pushed_block_pos = None
         new_pushed_block_pos = None
 
-        if direction == Direction.RIGHT and self.can_move_right():
-            if Point(x + BLOCK_SIZE, y) in self.blocks:
-                old_pushed_block_pos =  Point(x + BLOCK_SIZE, y)
-                if old_pushed_block_pos in self.holes:
-                    self.in_hole -= 1
-                new_pushed_block_pos = Point(x + BLOCK_SIZE * 2, y)
-                if new_pushed_block_pos in self.holes:
-                    self.in_hole += 1
-
-            x += BLOCK_SIZE
-
-        elif direction == Direction.LEFT and self.can_move_left():
-            if Point(x - BLOCK_SIZE, y) in self.blocks:
-                old_pushed_block_pos = Point(x - BLOCK_SIZE, y)
-                if old_pushed_block_pos in self.holes:
-                    self.in_hole -= 1
-                new_pushed_block_pos = Point(x - BLOCK_SIZE * 2, y)
-                if new_pushed_block_pos in self.holes:
-                    self.in_hole += 1
-            x -= BLOCK_SIZE
-
-        elif direction == Direction.DOWN and self.can_move_down():
-            if Point(x, y + BLOCK_SIZE) in self.blocks:
-                old_pushed_block_pos = Point(x, y + BLOCK_SIZE)
-                if old_pushed_block_pos in self.holes:
-                    self.in_hole -= 1
-                new_pushed_block_pos = Point(x, y + BLOCK_SIZE * 2)
-                if new_pushed_block_pos in self.holes:
-                    self.in_hole += 1
-            y += BLOCK_SIZE
-
-        elif direction == Direction.UP and self.can_move_up():
-            if Point(x, y - BLOCK_SIZE) in self.blocks:
-                old_pushed_block_pos = Point(x, y - BLOCK_SIZE)
-                if old_pushed_block_pos in self.holes:
-                    self.in_hole -= 1
-                new_pushed_block_pos = Point(x, y - BLOCK_SIZE * 2)
-                if new_pushed_block_pos in self.holes:
-                    self.in_hole += 1
-            y -= BLOCK_SIZE
+        block = self.block_grid[y, x]
+        if block != NO_BLOCK:
+            old_pushed_block_pos = Point(x, y)
+            new_pushed_block_pos = Point(x + dx, y + dy)
 
-        self.player = Point(x, y)
+            self.block_grid[y, x] = NO_BLOCK
+            self.block_grid[new_pushed_block_pos.y, new_pushed_block_pos.x] = block
+            self.blocks[block] = new_pushed_block_pos
 
-        if old_pushed_block_pos and new_pushed_block_pos:
-            self.blocks.remove(old_pushed_block_pos)
-            self.blocks.append(new_pushed_block_pos)
+            if self.hole_grid[y, x]:
+                self.in_hole -= 1
+            if self.hole_grid[new_pushed_block_pos.y, new_pushed_block_pos.x]:
+                self.in_hole += 1
+
+        self.player = Point(x, y)
 
         return old_pushed_block_pos, new_pushed_block_pos
 
     def _update_ui(self):
-        self.display.fill(BLACK)
-
-        p_pt = self.player
-        pygame.draw.rect(self.display, BLUE,
-                         pygame.Rect(p_pt.x, p_pt.y, BLOCK_SIZE, BLOCK_SIZE))
-        for b_pt in self.blocks:
-            pygame.draw.rect(self.display, RED,
-                             pygame.Rect(b_pt.x, b_pt.y, BLOCK_SIZE, BLOCK_SIZE))
-
-        for h_pt in self.holes:
-            if h_pt in self.blocks:
-                pygame.draw.rect(self.display, GREEN,
-                                 pygame.Rect(h_pt.x, h_pt.y, BLOCK_SIZE, BLOCK_SIZE))
-            elif h_pt == p_pt:
-                pygame.draw.rect(self.display, CYAN,
-                                 pygame.Rect(h_pt.x, h_pt.y, BLOCK_SIZE, BLOCK_SIZE))
-            else:
-                pygame.draw.rect(self.display, WHITE,
-                                 pygame.Rect(h_pt.x, h_pt.y, BLOCK_SIZE, BLOCK_SIZE))
-
-        # Update the screen
-        pygame.display.flip()
-        pass
+        # Draws the board if a renderer is attached, otherwise a no-op
+        if self.renderer:
+            self.renderer.draw()
+
+    def can_move(self, direction) -> bool:
+        dx, dy = DELTAS[direction]
+        x = self.player.x + dx
+        y = self.player.y + dy
+
+        if not self.in_bounds(x, y) or self.walls[y, x]:
+            return False
+        if self.block_grid[y, x] != NO_BLOCK:
+            # Checks if block cant be pushed (out of bounds, wall or another block behind it)
+            return self.is_free(x + dx, y + dy)
+        return True
+
+    def legal_moves(self, pushes=False):
+        # can_move for every action, as a (4,) bool array in action order (push_mask if pushes is set)
+        if pushes:
+            return self.push_mask()
+        return np.array([self.can_move(d) for d in ACTIONS])
+
+    def reachable(self):
+        """
+        Flood fill of the cells the player can walk to without pushing anything.
+
+        Returns (dist, last): walking distance to every cell (-1 if it can't be reached) and the action
+        index of the last step of a shortest walk there, to trace the walk back from its end.
+        """
+        dist = np.full((self.h, self.w), -1, dtype=np.int32)
+        last = np.full((self.h, self.w), -1, dtype=np.int8)
+        dist[self.player.y, self.player.x] = 0
+        queue = deque([self.player])
+        while queue:
+            x, y = queue.popleft()
+            for a, direction in enumerate(ACTIONS):
+                dx, dy = DELTAS[direction]
+                nx, ny = x + dx, y + dy
+                if self.is_free(nx, ny) and dist[ny, nx] < 0:
+                    dist[ny, nx] = dist[y, x] + 1
+                    last[ny, nx] = a
+                    queue.append((nx, ny))
+        return dist, last
+
+    def push_mask(self, dist=None):
+        # (num_objects * 4,) bool of the pushes the player can walk to and make, push i * 4 + a moves block i in ACTIONS[a]
+        if dist is None:
+            dist, _ = self.reachable()
+        mask = np.zeros((self.num_objects, 4), dtype=bool)
+        for i, (bx, by) in enumerate(self.blocks):
+            for a, direction in enumerate(ACTIONS):
+                dx, dy = DELTAS[direction]
+                mask[i, a] = (self.in_bounds(bx - dx, by - dy) and dist[by - dy, bx - dx] >= 0
+                              and self.is_free(bx + dx, by + dy))
+        return mask.ravel()
+
+    def push_step(self, push):
+        """
+        Macro action: walks the player to block push // 4 along a shortest path and pushes it in ACTIONS[push % 4].
+
+        Every walking move and the push are played with play_step, so rewards, the move limit and the
+        deadlock checks are the same as moving one cell at a time. Returns (reward, game_over, win, moves)
+        with the summed reward and the number of single moves made. A push that can't be reached or made
+        costs one move and the no-op penalty, like walking into a wall.
+        """
+        block, a = divmod(int(push), 4)
+        dx, dy = DELTAS[ACTIONS[a]]
+        bx, by = (int(c) for c in self.blocks[block])
+        sx, sy = bx - dx, by - dy
+
+        dist, last = self.reachable()
+        if not (self.in_bounds(sx, sy) and dist[sy, sx] >= 0 and self.is_free(bx + dx, by + dy)):
+            self.moves_made += 1
+            reward = -5.1
+            # same ending as a play_step that doesn't move: a board dead from the start or the move limit
+            if self.dead_on_arrival or self.moves_made > 1600:
+                return reward - 5, True, False, 1
+            return reward, False, False, 1
+
+        # Trace the walk back from the cell behind the block
+        walk = []
+        x, y = sx, sy
+        while (x, y) != self.player:
+            step = int(last[y, x])
+            walk.append(step)
+            x, y = x - DELTAS[ACTIONS[step]][0], y - DELTAS[ACTIONS[step]][1]
+        walk.reverse()
+        walk.append(a)
+
+        total = 0
+        for moves, step in enumerate(walk, 1):
+            reward, game_over, win = self.play_step(ACTIONS[step])
+            total += reward
+            if game_over:
+                return total, True, win, moves
+        return total, False, False, len(walk)
 
     def can_move_right(self) -> bool:
-        x = self.player.x
-        y = self.player.y
-
-        if (x + BLOCK_SIZE) < self.w:
-            new_x = x + BLOCK_SIZE
-            if Point(new_x, y) in self.blocks:
-                # Checks if block cant be pushed (out of bounds, or another block to blocks right)
-                if new_x + BLOCK_SIZE >= self.w or Point(new_x + BLOCK_SIZE, y) in self.blocks:
-                    return False
-            return True
-        return False
+        return self.can_move(Direction.RIGHT)
 
     def can_move_left(self) -> bool:
-        x = self.player.x
-        y = self.player.y
-        if (x - BLOCK_SIZE) >= 0:
-            new_x = x - BLOCK_SIZE
-            if Point(new_x, y) in self.blocks:
-                # Checks if block cant be pushed (out of bounds, or another block to blocks left)
-                if new_x - BLOCK_SIZE < 0 or Point(new_x - BLOCK_SIZE, y) in self.blocks:
-                    return False
-            return True
-        return False
+        return self.can_move(Direction.LEFT)
 
     def can_move_down(self) -> bool:
-        x = self.player.x
-        y = self.player.y
-        if (y + BLOCK_SIZE) < self.h:
-            new_y = y + BLOCK_SIZE
-            if Point(x, new_y) in self.blocks:
-                # Checks if block cant be pushed (out of bounds, or another block to blocks down)
-                if new_y + BLOCK_SIZE >= self.w or Point(x, new_y + BLOCK_SIZE) in self.blocks:
-                    return False
-            return True
-        return False
+        return self.can_move(Direction.DOWN)
 
     def can_move_up(self) -> bool:
-        x = self.player.x
-        y = self.player.y
-        if (y - BLOCK_SIZE) >= 0:
-            new_y = y - BLOCK_SIZE
-            if Point(x, new_y) in self.blocks:
-                # Checks if block cant be pushed (out of bounds, or another block to blocks up)
-                if new_y - BLOCK_SIZE < 0 or Point(x, new_y - BLOCK_SIZE) in self.blocks:
-                    return False
-            return True
-        return False
+        return self.can_move(Direction.UP)
 
     def player_state(self):
-        return [self.player.x / BLOCK_SIZE, self.player.y / BLOCK_SIZE]
+        return [self.player.x, self.player.y]
 
     def block_state(self):
-        res = []
-        x1 = self.player.x
-        y1 = self.player.y
-        # UP, DOWN, LEFT, RIGHT
-        for block in self.blocks:
-            x2 = block.x
-            y2 = block.y
-            res.append((x1 - x2) / BLOCK_SIZE)
-            res.append((y1 - y2) / BLOCK_SIZE)
-
-        return res
+        # (player - block) x, y offsets for every block
+        return (np.array(self.player) - self.blocks).ravel().tolist()
+
+    def feature_state(self):
+        # The feature list described in Agent.get_state
+        # len = 4
+        state = [
+            self.can_move_up(),
+            self.can_move_down(),
+            self.can_move_left(),
+            self.can_move_right()
+        ]
+
+        # len = 2
+        state.extend(self.player_state())
+        # len = num_objects * 2
+        state.extend(self.block_state())
+        # len = num_objects * 2
+        state.extend(self.hole_state())
+
+        return np.array(state, dtype=int)  # convert bools and floats to np array,
+
+    def grid_state(self, size=None):
+        # (4, size, size) uint8 planes: walls, blocks, holes, player, cells past the board's edge count as walls
+        size = size or max(self.w, self.h)
+        planes = np.zeros((4, size, size), dtype=np.uint8)
+        planes[0] = 1
+        planes[0, :self.h, :self.w] = self.walls
+        planes[1, :self.h, :self.w] = self.block_grid != NO_BLOCK
+        planes[2, :self.h, :self.w] = self.hole_grid
+        planes[3, self.player.y, self.player.x] = 1
+        return planes
 
     def hole_state(self):
-        res = []
-        x1 = self.player.x
-        y1 = self.player.y
-        # UP, DOWN, LEFT, RIGHT
-        for hole in self.holes:
-            x2 = hole.x
-            y2 = hole.y
-            res.append((x1 - x2) / BLOCK_SIZE)
-            res.append((y1 - y2) / BLOCK_SIZE)
-
-        return res
\ No newline at end of file
+        # (player - hole) x, y offsets for every hole
+        return (np.array(self.player) - self.holes).ravel().tolist()
@@ -0,0 +1,61 @@
+import pygame
+
+from sokobanbot import Point
+
+# RGB color definitions
+WHITE = (255, 255, 255)
+RED = (200, 0, 0)
+BLUE = (0, 0, 255)
+GREEN = (0, 255, 0)
+BLACK = (0, 0, 0)
+CYAN = (0, 255, 255)
+PINK = (255, 0, 255)
+
+# Size of each board cell in pixels
+BLOCK_SIZE = 80
+
+
+# Draws a Sokoban game with pygame, only created when the game is made with render=True
+class SokobanRenderer:
+    def __init__(self, game):
+        self.game = game
+
+        # Initialize pygame modules and the game window
+        pygame.init()
+        self.font = pygame.font.Font('arial.ttf', 25)
+        self.display = pygame.display.set_mode((game.w * BLOCK_SIZE, game.h * BLOCK_SIZE))
+        pygame.display.set_caption('Sokoban')
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                quit()
+
+    def _rect(self, color, pt):
+        pygame.draw.rect(self.display, color,
+                         pygame.Rect(pt.x * BLOCK_SIZE, pt.y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE))
+
+    def draw(self):
+        game = self.game
+        self.display.fill(BLACK)
+
+        for y, x in zip(*game.walls.nonzero()):
+            self._rect(PINK, Point(x, y))
+
+        p_pt = game.player
+        self._rect(BLUE, p_pt)
+        for b_pt in game.blocks:
+            self._rect(RED, Point(*b_pt))
+
+        for h_pt in game.holes:
+            h_pt = Point(*h_pt)
+            if game.paired(h_pt):
+                self._rect(GREEN, h_pt)
+            elif h_pt == p_pt:
+                self._rect(CYAN, h_pt)
+            else:
+                self._rect(WHITE, h_pt)
+
+        # Update the screen
+        pygame.display.flip()
@@ -0,0 +1,206 @@
+import numpy as np
+
+import deadlock
+from sokobanbot import Sokoban, ACTIONS, DELTAS, NO_BLOCK
+
+# (dx, dy) for each action index, same order as sokobanbot.ACTIONS: [up, down, left, right]
+ACTION_DELTAS = np.array([DELTAS[d] for d in ACTIONS], dtype=np.int64)
+
+
+# N Sokoban boards of the same size stored as stacked arrays and stepped together
+# Rewards, game over and win rules match Sokoban.play_step, boards that finish are reset automatically
+class VectorSokoban:
+    def __init__(self, num_envs, w=9, h=9, num_objects=1, level_pool=None):
+        self.num_envs = num_envs
+        self.w = w
+        self.h = h
+        self.num_objects = num_objects
+
+        n, k = num_envs, num_objects
+        # Same layout as Sokoban with a leading board axis
+        self.walls = np.zeros((n, h, w), dtype=bool)
+        self.hole_grid = np.zeros((n, h, w), dtype=bool)
+        self.block_grid = np.full((n, h, w), NO_BLOCK, dtype=np.int16)
+        self.blocks = np.zeros((n, k, 2), dtype=np.int64)
+        self.holes = np.zeros((n, k, 2), dtype=np.int64)
+        self.player = np.zeros((n, 2), dtype=np.int64)
+        self.distances = np.zeros((n, k, h, w))
+        self.in_hole = np.zeros(n, dtype=np.int64)
+        self.moves_made = np.zeros(n, dtype=np.int64)
+        self.dead_squares = np.zeros((n, h, w), dtype=bool)
+        self.dead_on_arrival = np.zeros(n, dtype=bool)
+
+        # Single game used to generate new boards, so levels come from the same place as Sokoban.reset
+        self._level_source = Sokoban(w, h, num_objects, level_pool=level_pool)
+        self._rows = np.arange(n)
+
+        self.reset()
+
+    def reset(self, idx=None):
+        # Resets the given boards (all of them if idx is None)
+        idx = self._rows if idx is None else np.asarray(idx)
+        game = self._level_source
+        for i in idx:
+            game.reset()
+            self.walls[i] = game.walls
+            self.hole_grid[i] = game.hole_grid
+            self.block_grid[i] = game.block_grid
+            self.blocks[i] = game.blocks
+            self.holes[i] = game.holes
+            self.player[i] = game.player
+            self.distances[i] = game.distances
+            self.in_hole[i] = game.in_hole
+            self.moves_made[i] = 0
+            self.dead_squares[i] = game.dead_squares
+            self.dead_on_arrival[i] = game.dead_on_arrival
+
+    def _in_bounds(self, pos):
+        return (pos[..., 0] >= 0) & (pos[..., 0] < self.w) & (pos[..., 1] >= 0) & (pos[..., 1] < self.h)
+
+    def _lookup(self, grid, pos, fill):
+        # grid[board, y, x] for every board, fill where pos is off the board
+        inside = self._in_bounds(pos)
+        x = np.clip(pos[:, 0], 0, self.w - 1)
+        y = np.clip(pos[:, 1], 0, self.h - 1)
+        return np.where(inside, grid[self._rows, y, x], fill)
+
+    def _move_checks(self, deltas):
+        # Returns (can move, block id in front of the player) for an (N, 2) array of moves
+        target = self.player + deltas
+        beyond = target + deltas
+
+        target_open = ~self._lookup(self.walls, target, True)
+        target_block = self._lookup(self.block_grid, target, NO_BLOCK)
+        beyond_free = ~self._lookup(self.walls, beyond, True) & (self._lookup(self.block_grid, beyond, NO_BLOCK) == NO_BLOCK)
+
+        can = target_open & ((target_block == NO_BLOCK) | beyond_free)
+        return can, target_block
+
+    def can_move(self):
+        # (N, 4) bool, [up, down, left, right] for every board
+        return np.stack([self._move_checks(np.broadcast_to(d, (self.num_envs, 2)))[0]
+                         for d in ACTION_DELTAS], axis=1)
+
+    def _on_border(self, pos):
+        return (pos[:, 0] == 0) | (pos[:, 0] == self.w - 1) | (pos[:, 1] == 0) | (pos[:, 1] == self.h - 1)
+
+    def immovable_block_detect(self, p, old, new):
+        # Sokoban.immovable_block_detect for the blocks pushed on boards p, returns a bool array over p
+        dead = self.dead_squares[p, new[:, 1], new[:, 0]].copy()
+
+        # freeze / 2x2 patterns need a small search, only run them for boards not already caught
+        for j in np.nonzero(~dead)[0]:
+            i = p[j]
+            x, y = new[j]
+            dead[j] = deadlock.square_deadlock(self.walls[i], self.block_grid[i], self.hole_grid[i], x, y) \
+                or deadlock.freeze_deadlock(self.walls[i], self.dead_squares[i], self.block_grid[i], self.hole_grid[i], x, y)
+
+        on_border = self._on_border(old) | self._on_border(new)
+        check = on_border & ~dead
+        dead[check] = self.border_count_deadlock()[p[check]]
+        return dead
+
+    def border_count_deadlock(self):
+        # Vectorized Sokoban.border_count_deadlock, returns an (N,) bool array
+        rows = self._rows[:, None]
+        bx, by = self.blocks[..., 0], self.blocks[..., 1]
+        loose = ~self.hole_grid[rows, by, bx]
+
+        hx, hy = self.holes[..., 0], self.holes[..., 1]
+        free = self.block_grid[rows, hy, hx] == NO_BLOCK
+
+        def border_counts(xs, ys, mask, exclusive):
+            left = xs == 0
+            right = xs == self.w - 1
+            up = ys == 0
+            down = ys == self.h - 1
+            if exclusive:
+                right &= ~left
+                up &= ~left & ~right
+                down &= ~left & ~right & ~up
+            return np.stack([(side & mask).sum(axis=1) for side in (up, down, left, right)], axis=1)
+
+        # a hole in a corner is on two borders and counts for both
+        over = border_counts(bx, by, loose, True) > border_counts(hx, hy, free, False)
+        return over.any(axis=1)
+
+    def play_step(self, actions):
+        # actions is an (N,) array of action indices, or (N, 4) one-hot rows
+        actions = np.asarray(actions)
+        if actions.ndim == 2:
+            actions = actions.argmax(axis=1)
+
+        deltas = ACTION_DELTAS[actions]
+        can, block = self._move_checks(deltas)
+        push = can & (block != NO_BLOCK)
+
+        self.moves_made += 1
+        reward = np.full(self.num_envs, -0.1)
+        reward[~can] -= 5
+
+        deadlocked = self.dead_on_arrival | (self.moves_made > 1600)
+
+        # Push blocks
+        p = np.nonzero(push)[0]
+        if len(p):
+            b = block[p]
+            old = self.player[p] + deltas[p]
+            new = old + deltas[p]
+
+            self.block_grid[p, old[:, 1], old[:, 0]] = NO_BLOCK
+            self.block_grid[p, new[:, 1], new[:, 0]] = b
+            self.blocks[p, b] = new
+            self.in_hole[p] += self.hole_grid[p, new[:, 1], new[:, 0]].astype(np.int64) \
+                - self.hole_grid[p, old[:, 1], old[:, 0]]
+
+            # Same distance reward as Sokoban.push_reward
+            old_dist = self.distances[p, :, old[:, 1], old[:, 0]]  # (pushes, holes)
+            new_dist = self.distances[p, :, new[:, 1], new[:, 0]]
+
+            hole_blocks = self.block_grid[p[:, None], self.holes[p, :, 1], self.holes[p, :, 0]]
+            usable = ((hole_blocks == NO_BLOCK) | (hole_blocks == b[:, None])) & np.isfinite(new_dist)
+
+            closer = usable & (new_dist < old_dist)
+            # distances are whole numbers, a 0 here means the block reached a hole and gets 50 below
+            closest = np.clip(np.where(closer, new_dist, np.inf).min(axis=1), 1, 7)
+            farthest = np.maximum(1, np.where(usable, new_dist, 0).max(axis=1))
+            push_reward = np.where(closer.any(axis=1), 5 / closest, farthest)
+            push_reward[(usable & (new_dist == 0)).any(axis=1)] = 50
+            reward[p] += push_reward
+
+            deadlocked[p] |= self.immovable_block_detect(p, old, new)
+
+        # Move players
+        self.player[can] += deltas[can]
+
+        win = self.in_hole == self.num_objects
+        dead = ~win & deadlocked
+        reward[win] += 300
+        reward[dead] -= 5
+        done = win | dead
+
+        if done.any():
+            self.reset(np.nonzero(done)[0])
+
+        return reward, done, win
+
+    def get_state(self):
+        # Batched Agent.get_state, (N, 6 + 4 * num_objects) int array
+        player = self.player[:, None, :]
+        return np.concatenate([
+            self.can_move(),
+            self.player,
+            (player - self.blocks).reshape(self.num_envs, -1),
+            (player - self.holes).reshape(self.num_envs, -1),
+        ], axis=1).astype(int)
+
+    def get_grid_state(self, size=None):
+        # Batched Sokoban.grid_state, (N, 4, size, size) uint8 array
+        size = size or max(self.w, self.h)
+        planes = np.zeros((self.num_envs, 4, size, size), dtype=np.uint8)
+        planes[:, 0] = 1
+        planes[:, 0, :self.h, :self.w] = self.walls
+        planes[:, 1, :self.h, :self.w] = self.block_grid != NO_BLOCK
+        planes[:, 2, :self.h, :self.w] = self.hole_grid
+        planes[self._rows, 3, self.player[:, 1], self.player[:, 0]] = 1
+        return planes
@@ -0,0 +1,267 @@
+import heapq
+import random
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+import deadlock
+
+# (dx, dy) in the agent's action order: [up, down, left, right]
+MOVES = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+# solved: a solution was found, moves / pushes: its length, actions: action indices to play it
+# nodes: states expanded, seconds: time spent searching
+SolveResult = namedtuple('SolveResult', 'solved, moves, pushes, actions, nodes, seconds')
+
+
+class Solver:
+    """
+    Search based solver over push moves for a Sokoban level.
+
+    Every node is a board after a push, its children are every push the player can walk to. The player's
+    walk is resolved with a flood fill, boards are hashed with Zobrist keys into a transposition table, and
+    pushes into dead squares, freeze or 2x2 deadlocks are never expanded.
+
+    metric='moves' finds the fewest total moves (walking + pushing), comparable to the moves counted in
+    agent.train. metric='pushes' finds the fewest pushes, and normalises the player to the top-left most
+    cell it can reach so boards that only differ by where the player stands are searched once.
+    """
+
+    def __init__(self, game, metric='moves', seed=0):
+        self.w = game.w
+        self.h = game.h
+        self.metric = metric
+        self.walls = game.walls.copy()
+        self.hole_grid = game.hole_grid.copy()
+        self.goals = frozenset(self._cell(x, y) for x, y in game.holes)
+        self.start_player = self._cell(*game.player)
+        self.start_boxes = frozenset(self._cell(x, y) for x, y in game.blocks)
+
+        # Fewest pushes from each cell to the nearest hole, a lower bound on the moves / pushes left per box
+        distances = deadlock.push_distances(self.walls, game.holes)
+        self.min_dist = distances.min(axis=0).ravel()
+        self.dead = ~self.walls & np.isinf(distances).all(axis=0)
+
+        # Zobrist keys, a board's hash is the xor of its box keys and player key
+        rng = random.Random(seed)
+        cells = self.w * self.h
+        self.box_keys = [rng.getrandbits(64) for _ in range(cells)]
+        self.player_keys = [rng.getrandbits(64) for _ in range(cells)]
+
+        # Scratch grid for the deadlock checks
+        self._grid = np.full((self.h, self.w), -1, dtype=np.int16)
+
+    def _cell(self, x, y):
+        return int(y) * self.w + int(x)
+
+    def _open(self, x, y):
+        return 0 <= x < self.w and 0 <= y < self.h and not self.walls[y, x]
+
+    def _flood(self, player, boxes):
+        # Walking distance and first-step parent for every cell the player can reach without pushing
+        dist = {player: 0}
+        parent = {player: None}
+        queue = deque([player])
+        while queue:
+            cell = queue.popleft()
+            x, y = cell % self.w, cell // self.w
+            for action, (dx, dy) in enumerate(MOVES):
+                nx, ny = x + dx, y + dy
+                n = ny * self.w + nx
+                if self._open(nx, ny) and n not in dist and n not in boxes:
+                    dist[n] = dist[cell] + 1
+                    parent[n] = (cell, action)
+                    queue.append(n)
+        return dist, parent
+
+    def _heuristic(self, boxes):
+        return sum(self.min_dist[b] for b in boxes)
+
+    def _hash(self, player, boxes):
+        key = self.player_keys[player]
+        for b in boxes:
+            key ^= self.box_keys[b]
+        return key
+
+    def _deadlocked(self, boxes, new_box):
+        grid = self._grid
+        for b in boxes:
+            grid[b // self.w, b % self.w] = 0
+        x, y = new_box % self.w, new_box // self.w
+        dead = deadlock.block_deadlocked(self.walls, self.dead, grid, self.hole_grid, x, y)
+        for b in boxes:
+            grid[b // self.w, b % self.w] = -1
+        return dead
+
+    def _children(self, player, boxes, key):
+        # Yields (cost, player, boxes, key, push) for every push reachable from this board
+        reach, _ = self._flood(player, boxes)
+        for box in boxes:
+            bx, by = box % self.w, box // self.w
+            for action, (dx, dy) in enumerate(MOVES):
+                behind = self._cell(bx - dx, by - dy) if self._open(bx - dx, by - dy) else None
+                if behind not in reach or not self._open(bx + dx, by + dy):
+                    continue
+                target = self._cell(bx + dx, by + dy)
+                if target in boxes or self.dead[by + dy, bx + dx]:
+                    continue
+
+                new_boxes = (boxes - {box}) | {target}
+                if self._deadlocked(new_boxes, target):
+                    continue
+
+                cost = reach[behind] + 1 if self.metric == 'moves' else 1
+                new_key = key ^ self.box_keys[box] ^ self.box_keys[target] ^ self.player_keys[player] \
+                    ^ self.player_keys[box]
+                yield cost, box, new_boxes, new_key, (behind, action)
+
+    def _normalise(self, player, boxes, key):
+        # In pushes mode, swap the player for the smallest cell it can reach
+        if self.metric != 'pushes':
+            return player, key
+        reach, _ = self._flood(player, boxes)
+        norm = min(reach)
+        return norm, key ^ self.player_keys[player] ^ self.player_keys[norm]
+
+    def astar(self, max_nodes=200_000):
+        start = time.perf_counter()
+        player, key = self._normalise(self.start_player, self.start_boxes,
+                                      self._hash(self.start_player, self.start_boxes))
+        # real player position is kept next to the normalised one so the solution can be replayed
+        heap = [(self._heuristic(self.start_boxes), 0, 0, key, self.start_player, self.start_boxes)]
+        best_g = {key: 0}
+        parents = {key: None}
+        nodes = 0
+        tie = 1
+
+        while heap and nodes < max_nodes:
+            f, g, _, key, player, boxes = heapq.heappop(heap)
+            if g > best_g[key]:
+                continue
+            if boxes == self.goals:
+                return self._result(key, parents, nodes, start)
+            nodes += 1
+
+            for cost, new_player, new_boxes, new_key, push in self._children(player, boxes, self._hash(player, boxes)):
+                _, new_key = self._normalise(new_player, new_boxes, new_key)
+                new_g = g + cost
+                if new_g < best_g.get(new_key, float('inf')):
+                    best_g[new_key] = new_g
+                    parents[new_key] = (key, player, push)
+                    heapq.heappush(heap, (new_g + self._heuristic(new_boxes), new_g, tie, new_key, new_player, new_boxes))
+                    tie += 1
+
+        return SolveResult(False, None, None, None, nodes, time.perf_counter() - start)
+
+    def idastar(self, max_nodes=200_000):
+        start = time.perf_counter()
+        _, root = self._normalise(self.start_player, self.start_boxes, self._hash(self.start_player, self.start_boxes))
+        parents = {root: None}
+        nodes = 0
+
+        def search(player, boxes, key, g, bound, seen):
+            nonlocal nodes
+            f = g + self._heuristic(boxes)
+            if f > bound:
+                return f
+            if boxes == self.goals:
+                self._found = key
+                return True
+            nodes += 1
+            if nodes >= max_nodes:
+                return float('inf')
+
+            smallest = float('inf')
+            for cost, new_player, new_boxes, new_key, push in self._children(player, boxes, self._hash(player, boxes)):
+                _, new_key = self._normalise(new_player, new_boxes, new_key)
+                # transposition table, skip boards already reached as cheaply in this iteration
+                if seen.get(new_key, float('inf')) <= g + cost:
+                    continue
+                seen[new_key] = g + cost
+                parents[new_key] = (key, player, push)
+                found = search(new_player, new_boxes, new_key, g + cost, bound, seen)
+                if found is True:
+                    return True
+                smallest = min(smallest, found)
+            return smallest
+
+        bound = self._heuristic(self.start_boxes)
+        while nodes < max_nodes and bound != float('inf'):
+            self._found = None
+            found = search(self.start_player, self.start_boxes, root, 0, bound, {root: 0})
+            if found is True:
+                return self._result(self._found, parents, nodes, start)
+            bound = found
+
+        return SolveResult(False, None, None, None, nodes, time.perf_counter() - start)
+
+    def _result(self, key, parents, nodes, start):
+        # Walk the parent links back to the start and expand every push into its walk + push actions
+        pushes = []
+        while parents[key] is not None:
+            key, player, push = parents[key]
+            pushes.append((player, push))
+        pushes.reverse()
+
+        actions = []
+        boxes = set(self.start_boxes)
+        for player, (behind, action) in pushes:
+            _, parent = self._flood(player, boxes)
+            walk = []
+            cell = behind
+            while parent[cell] is not None:
+                cell, step = parent[cell]
+                walk.append(step)
+            actions.extend(reversed(walk))
+            actions.append(action)
+
+            dx, dy = MOVES[action]
+            box = behind + dy * self.w + dx
+            boxes.remove(box)
+            boxes.add(box + dy * self.w + dx)
+
+        return SolveResult(True, len(actions), len(pushes), actions, nodes, time.perf_counter() - start)
+
+
+def solve(game, method='astar', metric='moves', max_nodes=200_000):
+    solver = Solver(game, metric)
+    if method == 'idastar':
+        return solver.idastar(max_nodes)
+    return solver.astar(max_nodes)
+
+
+def solvable(game, max_nodes=200_000):
+    # True if a solution is found within max_nodes, False if the level is unsolvable or too big to tell
+    return solve(game, metric='pushes', max_nodes=max_nodes).solved
+
+
+if __name__ == '__main__':
+    import argparse
+    from sokobanbot import Sokoban
+
+    parser = argparse.ArgumentParser(description='Solve randomly generated levels and report solvability / optimal moves')
+    parser.add_argument('--w', type=int, default=9)
+    parser.add_argument('--h', type=int, default=9)
+    parser.add_argument('--boxes', type=int, default=1)
+    parser.add_argument('--levels', type=int, default=100)
+    parser.add_argument('--method', choices=['astar', 'idastar'], default='astar')
+    parser.add_argument('--metric', choices=['moves', 'pushes'], default='moves')
+    parser.add_argument('--max-nodes', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    game = Sokoban(args.w, args.h, args.boxes)
+    results = []
+    for _ in range(args.levels):
+        game.reset()
+        results.append(solve(game, args.method, args.metric, args.max_nodes))
+
+    solved = [r for r in results if r.solved]
+    print(f'Solvable: {len(solved)}/{len(results)}')
+    if solved:
+        print(f'Optimal {args.metric}: mean {np.mean([getattr(r, args.metric) for r in solved]):.1f}, '
+              f'best {min(getattr(r, args.metric) for r in solved)}')
+    print(f'Nodes: mean {np.mean([r.nodes for r in results]):.0f}, '
+          f'Time: mean {np.mean([r.seconds for r in results]) * 1000:.1f} ms')
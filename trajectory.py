@@ -0,0 +1,323 @@
+import json
+import os
+import queue
+import random
+import threading
+import zlib
+
+import numpy as np
+import torch
+
+from checkpoint import _atomic_write_text
+from replay import _save_array
+
+# Sentinel that tells a worker thread to finish
+_STOP = object()
+
+TRAJECTORY_VERSION = 1
+META = 'meta.json'
+EPISODES = 'episodes.npy'
+
+# Episode index, one row per recorded episode
+# frame / start: first state and first transition of the episode inside its chunk
+# done: False if the episode was cut off (training stopped) instead of ending in a win or a loss
+EPISODE = np.dtype([('chunk', '<u4'), ('frame', '<u4'), ('start', '<u4'), ('length', '<u4'),
+                    ('reward', '<f4'), ('done', '?')])
+
+# Columns of a chunk file, states holds every episode's length + 1 boards so next_states cost nothing extra
+COLUMNS = ('states', 'actions', 'rewards', 'dones', 'next_masks')
+
+
+class TrajectoryRecorder:
+    """
+    Streams played transitions to disk as chunked, compressed columnar files with an episode index.
+
+    add() only appends to the open episode of its env. Finished episodes collect into a chunk and every
+    chunk_size transitions the chunk is handed to a writer thread, which zlib compresses each column into
+    one chunk file and then atomically rewrites meta.json and episodes.npy. A crash loses at most the
+    chunk being filled. Read a recording back with TrajectoryDataset.
+    """
+
+    # state_shape / state_dtype as stored by the replay memory, level is the zlib level (0 = store raw, mmap friendly)
+    def __init__(self, directory, state_shape, state_dtype=np.float32, num_actions=4, chunk_size=16_384, level=6):
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, META)):
+            raise ValueError(f'{directory} already holds a recording')
+        self.directory = directory
+        self.state_shape = (state_shape,) if isinstance(state_shape, int) else tuple(state_shape)
+        self.state_dtype = np.dtype(state_dtype)
+        self.num_actions = num_actions
+        self.chunk_size = chunk_size
+        self.level = level
+
+        # env -> lists of the open episode's frames, actions, rewards, dones and next masks
+        self.open = {}
+        # Finished episodes waiting for the chunk to fill
+        self.pending = []
+        self.pending_transitions = 0
+        self.chunks = 0
+
+        self.meta = {
+            'version': TRAJECTORY_VERSION,
+            'state_shape': list(self.state_shape),
+            'state_dtype': self.state_dtype.str,
+            'num_actions': num_actions,
+            'compression': 'zlib' if level else None,
+            'chunks': [],
+        }
+        self.episodes = np.zeros(0, dtype=EPISODE)
+        self.jobs = queue.SimpleQueue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, state, action, reward, next_state, done, next_mask=None, env=0):
+        # action is the index of the move made, env keeps the episodes of several boards apart (train_vec)
+        episode = self.open.get(env)
+        if episode is None:
+            episode = self.open[env] = {'states': [np.array(state, dtype=self.state_dtype)], 'actions': [],
+                                        'rewards': [], 'dones': [], 'next_masks': []}
+        episode['states'].append(np.array(next_state, dtype=self.state_dtype))
+        episode['actions'].append(int(action))
+        episode['rewards'].append(float(reward))
+        episode['dones'].append(bool(done))
+        episode['next_masks'].append(np.ones(self.num_actions, dtype=bool) if next_mask is None
+                                     else np.asarray(next_mask, dtype=bool))
+        if done:
+            self.end_episode(env)
+
+    def add_batch(self, states, actions, rewards, next_states, dones, next_masks=None):
+        # One transition per board of a VectorSokoban step, row i belongs to env i
+        for i in range(len(states)):
+            self.add(states[i], actions[i], rewards[i], next_states[i], dones[i],
+                     None if next_masks is None else next_masks[i], env=i)
+
+    def end_episode(self, env=0):
+        # Closes env's open episode, add() does this on done, call it directly for episodes cut off early
+        episode = self.open.pop(env, None)
+        if episode is None or not episode['actions']:
+            return
+        self.pending.append(episode)
+        self.pending_transitions += len(episode['actions'])
+        if self.pending_transitions >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # Hands the finished episodes to the writer as one chunk
+        if self._check() and self.pending:
+            self.jobs.put((self.chunks, self.pending))
+            self.chunks += 1
+            self.pending = []
+            self.pending_transitions = 0
+
+    def close(self):
+        # Cuts off open episodes, writes everything and waits for the writer
+        for env in list(self.open):
+            self.end_episode(env)
+        self.flush()
+        self.jobs.put(_STOP)
+        self.thread.join()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('Writing the trajectory recording failed') from self.error
+        return True
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is _STOP:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self._write(*job)
+            except Exception as e:
+                self.error = e
+
+    def _write(self, chunk, episodes):
+        columns = {
+            'states': np.stack([s for e in episodes for s in e['states']]),
+            'actions': np.array([a for e in episodes for a in e['actions']], dtype='<i2'),
+            'rewards': np.array([r for e in episodes for r in e['rewards']], dtype='<f4'),
+            'dones': np.array([d for e in episodes for d in e['dones']], dtype=bool),
+            'next_masks': np.stack([m for e in episodes for m in e['next_masks']]),
+        }
+
+        index = np.zeros(len(episodes), dtype=EPISODE)
+        frame = start = 0
+        for i, e in enumerate(episodes):
+            length = len(e['actions'])
+            index[i] = (chunk, frame, start, length, sum(e['rewards']), e['dones'][-1])
+            frame += length + 1
+            start += length
+
+        name = f'chunk_{chunk:06d}.bin'
+        table = {}
+        offset = 0
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            for column in COLUMNS:
+                data = np.ascontiguousarray(columns[column]).tobytes()
+                if self.level:
+                    data = zlib.compress(data, self.level)
+                f.write(data)
+                table[column] = [offset, len(data)]
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Index and meta last, a chunk only counts once they name it
+        self.episodes = np.concatenate([self.episodes, index])
+        tmp = os.path.join(self.directory, EPISODES + '.tmp')
+        _save_array(tmp, self.episodes)
+        os.replace(tmp, os.path.join(self.directory, EPISODES))
+        self.meta['chunks'].append({'file': name, 'transitions': start, 'frames': frame, 'columns': table})
+        _atomic_write_text(os.path.join(self.directory, META), json.dumps(self.meta))
+
+
+class TrajectoryDataset:
+    """
+    Read side of a TrajectoryRecorder recording.
+
+    Chunk files are memory mapped and a column is only read (and decompressed) when its chunk is asked
+    for. batches() decodes, shuffles and batches chunks on a background thread, a few batches ahead of the
+    caller, for offline QTrainer training. fill() warm starts a replay memory.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META)) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != TRAJECTORY_VERSION:
+            raise ValueError(f'{directory} is a version {self.meta["version"]} recording, expected {TRAJECTORY_VERSION}')
+        self.directory = directory
+        self.state_shape = tuple(self.meta['state_shape'])
+        self.state_dtype = np.dtype(self.meta['state_dtype'])
+        self.num_actions = self.meta['num_actions']
+        self.chunks = self.meta['chunks']
+        # Rows past the last chunk in meta belong to a chunk that wasn't finished
+        self.episodes = np.load(os.path.join(directory, EPISODES))
+        self.episodes = self.episodes[self.episodes['chunk'] < len(self.chunks)]
+        self.files = {}
+
+    def __len__(self):
+        return sum(chunk['transitions'] for chunk in self.chunks)
+
+    def _column(self, chunk, name, dtype, shape):
+        info = self.chunks[chunk]
+        data = self.files.get(chunk)
+        if data is None:
+            data = self.files[chunk] = np.memmap(os.path.join(self.directory, info['file']), dtype=np.uint8, mode='r')
+        offset, nbytes = info['columns'][name]
+        raw = data[offset:offset + nbytes]
+        if self.meta['compression'] == 'zlib':
+            raw = zlib.decompress(raw)
+        return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+    def chunk(self, i):
+        # Every transition of chunk i as numpy arrays: (states, actions, rewards, next_states, dones, next_masks)
+        info = self.chunks[i]
+        n = info['transitions']
+        frames = self._column(i, 'states', self.state_dtype, (info['frames'], *self.state_shape))
+        # copies, the decoded buffers and the map are read only
+        actions = self._column(i, 'actions', '<i2', (n,)).copy()
+        rewards = self._column(i, 'rewards', '<f4', (n,)).copy()
+        dones = self._column(i, 'dones', bool, (n,)).copy()
+        next_masks = self._column(i, 'next_masks', bool, (n, self.num_actions)).copy()
+
+        # Transition t of an episode starts on its frame + t, so the frame of transition j is j + episode number
+        episodes = self.episodes[self.episodes['chunk'] == i]
+        frame = np.arange(n) + np.repeat(episodes['frame'].astype(np.int64) - episodes['start'], episodes['length'])
+        return frames[frame], actions, rewards, frames[frame + 1], dones, next_masks
+
+    def batches(self, batch_size=1024, epochs=1, shuffle=True, seed=None, prefetch=4, device='cpu'):
+        # Yields (states, actions, rewards, next_states, dones, next_masks) tensor batches like ReplayBuffer.sample
+        # chunks are visited in random order and shuffled inside, prefetch batches are built ahead on a thread
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        device = torch.device(device)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            rng = random.Random(seed)
+            try:
+                for _ in range(epochs):
+                    order = list(range(len(self.chunks)))
+                    if shuffle:
+                        rng.shuffle(order)
+                    for i in order:
+                        columns = self.chunk(i)
+                        idx = np.arange(len(columns[1]))
+                        if shuffle:
+                            np.random.default_rng(rng.getrandbits(32)).shuffle(idx)
+                        for start in range(0, len(idx), batch_size):
+                            rows = idx[start:start + batch_size]
+                            states, actions, rewards, next_states, dones, next_masks = (
+                                torch.from_numpy(c[rows]) for c in columns)
+                            batch = (states.to(device).float(), actions.to(device).long(), rewards.to(device),
+                                     next_states.to(device).float(), dones.to(device), next_masks.to(device))
+                            if not put(batch):
+                                return
+                put(_STOP)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _STOP:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def fill(self, memory):
+        # Pushes the newest transitions that fit into a ReplayBuffer, returns how many were pushed
+        if tuple(memory.states.shape[1:]) != self.state_shape or memory.next_masks.shape[1] != self.num_actions:
+            raise ValueError(f'Recording holds {self.state_shape} states with {self.num_actions} actions, '
+                             f'the memory {tuple(memory.states.shape[1:])} states with {memory.next_masks.shape[1]}')
+        first = len(self.chunks)
+        total = 0
+        while first > 0 and total < memory.capacity:
+            first -= 1
+            total += self.chunks[first]['transitions']
+
+        pushed = 0
+        for i in range(first, len(self.chunks)):
+            states, actions, rewards, next_states, dones, next_masks = self.chunk(i)
+            skip = max(0, total - pushed - memory.capacity)
+            memory.push_batch(states[skip:], actions[skip:], rewards[skip:], next_states[skip:], dones[skip:],
+                              next_masks[skip:])
+            pushed += len(actions)
+        return min(pushed, memory.capacity)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarise a trajectory recording')
+    parser.add_argument('directory')
+    args = parser.parse_args()
+
+    dataset = TrajectoryDataset(args.directory)
+    episodes = dataset.episodes
+    size = sum(os.path.getsize(os.path.join(args.directory, c['file'])) for c in dataset.chunks)
+    print(f'{len(dataset)} transitions, {len(episodes)} episodes in {len(dataset.chunks)} chunks ({size / 2 ** 20:.1f} MiB)')
+    print(f'states {dataset.state_shape} {dataset.state_dtype}, {dataset.num_actions} actions, '
+          f'compression {dataset.meta["compression"]}')
+    if len(episodes):
+        print(f'episode length mean {episodes["length"].mean():.1f}, max {episodes["length"].max()}, '
+              f'{(~episodes["done"]).sum()} cut off, mean reward {episodes["reward"].mean():.2f}')